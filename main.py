@@ -6,23 +6,38 @@ Main application entry point
 
 import sys
 import os
+import atexit
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 from src.app import create_app
 from config.settings import Config
 
+def configure_logging():
+    """Route log records through a queue so file and console writes happen off the request threads"""
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    file_handler = logging.FileHandler('vector-health-bot.log')
+    stream_handler = logging.StreamHandler(sys.stdout)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    # The listener's handlers apply the full format; only the message is rendered before queueing
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    logging.basicConfig(level=logging.INFO, handlers=[queue_handler])
+    
+    listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
 def main():
     """Main application entry point"""
     try:
         # Configure logging
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('vector-health-bot.log'),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
+        configure_logging()
         
         logger = logging.getLogger(__name__)
         logger.info("Starting Vector-Health AI Nutritionist Bot")
@@ -2,12 +2,16 @@ from flask import Blueprint, request, jsonify
 import logging
 import hmac
 import hashlib
+import orjson
 from config.settings import Config
 from services.terra_service import TerraService
 
 terra_bp = Blueprint('terra', __name__)
 logger = logging.getLogger(__name__)
 
+# Content types of batched webhooks: one JSON payload per line
+JSON_LINES_MIMETYPES = ('application/jsonl', 'application/x-ndjson', 'application/x-jsonlines')
+
 @terra_bp.route('/webhook', methods=['POST'])
 def terra_webhook():
     """Handle incoming Terra API webhook requests"""
@@ -19,15 +23,30 @@ def terra_webhook():
                 logger.error("Invalid Terra webhook signature")
                 return jsonify({'error': 'Неверная подпись'}), 401
         
-        data = request.get_json()
+        # Parse the raw body with orjson: activity and sleep payloads carry long nested arrays
+        body = request.get_data()
+        try:
+            if request.mimetype in JSON_LINES_MIMETYPES:
+                data = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+            else:
+                data = orjson.loads(body) if body.strip() else None
+        except orjson.JSONDecodeError:
+            logger.error("Invalid JSON data received from Terra")
+            return jsonify({'error': 'Неверный формат JSON'}), 400
         
         if not data:
             logger.error("No JSON data received from Terra")
             return jsonify({'error': 'Данные JSON не получены'}), 400
         
-        # Process the webhook data with TerraService
+        # Reject anything that is not a webhook object before acknowledging it
+        payloads = data if isinstance(data, list) else [data]
+        if not all(isinstance(payload, dict) for payload in payloads):
+            logger.error("Terra webhook payload is not a JSON object")
+            return jsonify({'error': 'Неверный формат данных'}), 400
+        
+        # Acknowledge right away; TerraService writes the data in the background
         terra_service = TerraService()
-        result = terra_service.process_webhook(data)
+        result = terra_service.enqueue_webhook(data)
         
         return jsonify({'status': 'ok', 'result': result})
         
@@ -1,19 +1,23 @@
 import logging
+import uuid
 from typing import Dict, List, Optional
 from datetime import date, datetime, timedelta
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
 from models.user_profile import UserProfile
 from models.food_log import FoodLog
 from models.activity_log import ActivityLog
-from services.openai_service import OpenAIService
+from services.openai_service import OpenAIService, get_openai_service
+from utils.health_utils import ACTIVITY_MULTIPLIERS
 
 logger = logging.getLogger(__name__)
 
 class HealthService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, openai_service: Optional[OpenAIService] = None):
         """Initialize health service with database session"""
         self.db = db
-        self.openai_service = OpenAIService()
+        # Shared client: services are created per request, the OpenAI client is not
+        self.openai_service = openai_service or get_openai_service()
     
     def create_user_profile(self, user_id: int, chat_id: int = None) -> UserProfile:
         """Create a new user profile"""
@@ -66,62 +70,82 @@ class HealthService:
             if not user_profile:
                 return False
             
-            # Calculate BMR using Mifflin-St Jeor Equation
-            if user_profile.gender == 'male':
-                bmr = (10 * float(user_profile.current_weight_kg) + 
-                      6.25 * user_profile.height_cm - 
-                      5 * user_profile.age + 5)
-            else:  # female
-                bmr = (10 * float(user_profile.current_weight_kg) + 
-                      6.25 * user_profile.height_cm - 
-                      5 * user_profile.age - 161)
-            
-            # Calculate TDEE based on activity level
-            activity_multipliers = {
-                'sedentary': 1.2,
-                'moderate': 1.55,
-                'active': 1.725
-            }
-            
-            tdee = bmr * activity_multipliers.get(user_profile.activity_level, 1.2)
-            
-            # Adjust calories based on goal
-            if user_profile.goal == 'lose_weight':
-                daily_calories = int(tdee - 500)  # 500 calorie deficit
-            elif user_profile.goal == 'gain_weight':
-                daily_calories = int(tdee + 500)  # 500 calorie surplus
-            else:  # maintain_weight
-                daily_calories = int(tdee)
+            self._apply_calculated_targets(user_profile)
             
-            # Calculate macronutrient targets
-            # Protein: 1.6-2.2g per kg body weight (use 1.8g)
-            protein_target = float(user_profile.current_weight_kg) * 1.8
+            self.db.commit()
+            logger.info(f"Calculated targets for user {user_id}")
+            return True
             
-            # Fat: 20-35% of calories (use 25%)
-            fat_calories = daily_calories * 0.25
-            fat_target = fat_calories / 9  # 9 calories per gram of fat
+        except Exception as e:
+            logger.error(f"Error calculating user targets: {str(e)}")
+            self.db.rollback()
+            return False
+    
+    def update_profile_and_recalculate(self, user_id: int, updates: Dict) -> bool:
+        """Update user profile and recalculate BMR, TDEE, and daily targets in one transaction"""
+        try:
+            user_profile = self.get_user_profile(user_id)
+            if not user_profile:
+                return False
             
-            # Carbs: remaining calories
-            protein_calories = protein_target * 4  # 4 calories per gram of protein
-            carb_calories = daily_calories - protein_calories - fat_calories
-            carb_target = carb_calories / 4  # 4 calories per gram of carbs
+            for key, value in updates.items():
+                if hasattr(user_profile, key):
+                    setattr(user_profile, key, value)
             
-            # Update user profile
-            updates = {
-                'bmr': round(bmr, 2),
-                'tdee': round(tdee, 2),
-                'daily_calorie_target': daily_calories,
-                'daily_protein_target_g': round(protein_target, 2),
-                'daily_fat_target_g': round(fat_target, 2),
-                'daily_carbs_target_g': round(carb_target, 2)
-            }
+            self._apply_calculated_targets(user_profile)
             
-            return self.update_user_profile(user_id, updates)
+            self.db.commit()
+            logger.info(f"Updated user profile and recalculated targets for user {user_id}: {updates}")
+            return True
             
         except Exception as e:
-            logger.error(f"Error calculating user targets: {str(e)}")
+            logger.error(f"Error updating user profile with recalculation: {str(e)}")
+            self.db.rollback()
             return False
     
+    def _apply_calculated_targets(self, user_profile: UserProfile) -> None:
+        """Set BMR, TDEE, and daily targets on the profile from its current metrics (no commit)"""
+        # Calculate BMR using Mifflin-St Jeor Equation
+        if user_profile.gender == 'male':
+            bmr = (10 * float(user_profile.current_weight_kg) + 
+                  6.25 * user_profile.height_cm - 
+                  5 * user_profile.age + 5)
+        else:  # female
+            bmr = (10 * float(user_profile.current_weight_kg) + 
+                  6.25 * user_profile.height_cm - 
+                  5 * user_profile.age - 161)
+        
+        # Calculate TDEE based on activity level
+        tdee = bmr * ACTIVITY_MULTIPLIERS.get(user_profile.activity_level, 1.2)
+        
+        # Adjust calories based on goal
+        if user_profile.goal == 'lose_weight':
+            daily_calories = int(tdee - 500)  # 500 calorie deficit
+        elif user_profile.goal == 'gain_weight':
+            daily_calories = int(tdee + 500)  # 500 calorie surplus
+        else:  # maintain_weight
+            daily_calories = int(tdee)
+        
+        # Calculate macronutrient targets
+        # Protein: 1.6-2.2g per kg body weight (use 1.8g)
+        protein_target = float(user_profile.current_weight_kg) * 1.8
+        
+        # Fat: 20-35% of calories (use 25%)
+        fat_calories = daily_calories * 0.25
+        fat_target = fat_calories / 9  # 9 calories per gram of fat
+        
+        # Carbs: remaining calories
+        protein_calories = protein_target * 4  # 4 calories per gram of protein
+        carb_calories = daily_calories - protein_calories - fat_calories
+        carb_target = carb_calories / 4  # 4 calories per gram of carbs
+        
+        user_profile.bmr = round(bmr, 2)
+        user_profile.tdee = round(tdee, 2)
+        user_profile.daily_calorie_target = daily_calories
+        user_profile.daily_protein_target_g = round(protein_target, 2)
+        user_profile.daily_fat_target_g = round(fat_target, 2)
+        user_profile.daily_carbs_target_g = round(carb_target, 2)
+    
     def log_food_from_photo(self, user_id: int, food_data: Dict, photo_url: str) -> FoodLog:
         """Log food from photo analysis"""
         try:
@@ -297,13 +321,24 @@ class HealthService:
             logger.error(f"Error searching similar foods: {str(e)}")
             return []
 
-    def get_food_logs_for_date(self, user_id: int, target_date: date) -> List[FoodLog]:
-        """Get food logs for a specific date"""
+    def get_food_logs_for_date(self, user_id: int, target_date: date) -> List:
+        """
+        Get food log list entries for a specific date
+        
+        Returns narrow rows (log_id, short_name, calories, estimated_weight_g) where
+        short_name is the dish name truncated to 20 characters (with "...") by the database.
+        """
         try:
             start_datetime = datetime.combine(target_date, datetime.min.time())
             end_datetime = datetime.combine(target_date, datetime.max.time())
             
-            return (self.db.query(FoodLog)
+            dish_name = func.coalesce(FoodLog.dish_name, FoodLog.description)
+            short_name = case(
+                (func.length(dish_name) > 20, func.concat(func.substr(dish_name, 1, 20), '...')),
+                else_=dish_name
+            ).label('short_name')
+            
+            return (self.db.query(FoodLog.log_id, short_name, FoodLog.calories, FoodLog.estimated_weight_g)
                    .filter(FoodLog.user_id == user_id)
                    .filter(FoodLog.created_at >= start_datetime)
                    .filter(FoodLog.created_at <= end_datetime)
@@ -316,7 +351,11 @@ class HealthService:
     def get_food_log_by_id(self, log_id: str) -> Optional[FoodLog]:
         """Get food log by ID"""
         try:
-            return self.db.query(FoodLog).filter(FoodLog.log_id == log_id).first()
+            # Primary key lookup is served from the identity map when the log is already loaded
+            return self.db.get(FoodLog, uuid.UUID(str(log_id)))
+        except ValueError:
+            logger.error(f"Invalid food log ID: {log_id}")
+            return None
         except Exception as e:
             logger.error(f"Error getting food log by ID: {str(e)}")
             return None
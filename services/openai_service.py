@@ -1,6 +1,7 @@
 import openai
 import json
 import logging
+import threading
 from typing import Dict, List, Optional
 from config.settings import Config
 
@@ -639,3 +640,14 @@ class OpenAIService:
             logger.error(f"Error answering nutrition question: {str(e)}")
             raise
 
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+def get_openai_service() -> OpenAIService:
+    """Get the process-wide OpenAI service, creating its HTTP client on first use"""
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = OpenAIService()
+    return _shared_service
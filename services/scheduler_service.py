@@ -8,7 +8,7 @@ import pytz
 from sqlalchemy import func
 from database.connection import get_db
 from services.health_service import HealthService
-from services.openai_service import OpenAIService
+from services.openai_service import get_openai_service
 from services.telegram_service import TelegramService
 from models.user_profile import UserProfile
 
@@ -18,7 +18,7 @@ class SchedulerService:
     def __init__(self):
         """Initialize scheduler service"""
         self.telegram_service = TelegramService()
-        self.openai_service = OpenAIService()
+        self.openai_service = get_openai_service()
         self.is_running = False
         self.scheduler_thread = None
     
@@ -83,7 +83,7 @@ class SchedulerService:
             for user in users_to_notify:
                 try:
                     logger.info(f"Sending daily report to user {user.user_id} (chat_id: {user.chat_id})")
-                    self._send_daily_report_to_user(user.user_id, health_service)
+                    self._send_daily_report_to_user(user.user_id, health_service, user.chat_id)
                     success_count += 1
                     time.sleep(1)  # Small delay between users to avoid rate limits
                 except Exception as e:
@@ -117,7 +117,7 @@ class SchedulerService:
             
             for user in active_users:
                 try:
-                    self._send_daily_report_to_user(user.user_id, health_service)
+                    self._send_daily_report_to_user(user.user_id, health_service, user.chat_id)
                     time.sleep(1)  # Small delay between users to avoid rate limits
                 except Exception as e:
                     logger.error(f"Error sending daily report to user {user.user_id}: {str(e)}")
@@ -147,7 +147,7 @@ class SchedulerService:
             
             for user in active_users:
                 try:
-                    self._send_weekly_report_to_user(user.user_id, health_service)
+                    self._send_weekly_report_to_user(user.user_id, health_service, user.chat_id)
                     time.sleep(1)  # Small delay between users to avoid rate limits
                 except Exception as e:
                     logger.error(f"Error sending weekly report to user {user.user_id}: {str(e)}")
@@ -201,8 +201,8 @@ class SchedulerService:
             logger.error(f"Error getting users for daily report: {str(e)}")
             return []
     
-    def _send_daily_report_to_user(self, user_id: int, health_service: HealthService):
-        """Send daily report to specific user"""
+    def _send_daily_report_to_user(self, user_id: int, health_service: HealthService, chat_id: int = None):
+        """Send daily report to specific user (chat_id is looked up if not already known)"""
         try:
             logger.debug(f"Generating daily report for user {user_id}")
             
@@ -221,7 +221,7 @@ class SchedulerService:
                 return
             
             # Get user's chat_id
-            chat_id = self._get_user_chat_id(user_id)
+            chat_id = chat_id or self._get_user_chat_id(user_id)
             
             if chat_id:
                 # Send the report
@@ -235,12 +235,12 @@ class SchedulerService:
             logger.error(f"Error sending daily report to user {user_id}: {str(e)}")
             raise
     
-    def _send_weekly_report_to_user(self, user_id: int, health_service: HealthService):
-        """Send weekly report to specific user"""
+    def _send_weekly_report_to_user(self, user_id: int, health_service: HealthService, chat_id: int = None):
+        """Send weekly report to specific user (chat_id is looked up if not already known)"""
         try:
             # Get weekly summary (you might need to implement this)
             # For now, we'll send a simple weekly message
-            chat_id = self._get_user_chat_id(user_id)
+            chat_id = chat_id or self._get_user_chat_id(user_id)
             
             if chat_id:
                 message = """📈 Еженедельный отчет
@@ -274,6 +274,9 @@ class SchedulerService:
         except Exception as e:
             logger.error(f"Error getting chat_id for user {user_id}: {str(e)}")
             return None
+        finally:
+            if 'db' in locals():
+                db.close()
     
     def send_manual_daily_report(self, user_id: int, chat_id: int):
         """Send daily report manually (for testing or immediate sending)"""
@@ -1,24 +1,178 @@
-import requests
 import json
 import logging
+import re
+import threading
+from functools import lru_cache, partial
+from time import monotonic
 from typing import Dict, Optional
 from datetime import datetime, date, time
 from config.settings import Config
-from services.openai_service import OpenAIService
+from services.openai_service import get_openai_service
 from services.health_service import HealthService
-from services.terra_service import TerraService
+from services.terra_service import TerraService, invalidate_terra_user_cache
 from database.connection import get_db
+from utils.http_utils import create_http_session
 from utils.telegram_utils import parse_markdown_to_entities, clean_keyboard_markup
 from utils.user_states import state_manager, States
 
 logger = logging.getLogger(__name__)
 
+# Message shown after a food log weight edit (values are recalculated proportionally).
+# Gram values are pre-formatted with _format_grams, calories are ints.
+_FOOD_UPDATE_TEMPLATE = """✅ *Вес успешно обновлен!*
+
+📊 *Новые значения:*
+• Вес: {new_weight}г (было {old_weight}г)
+• Калории: {new_calories} ккал (было {old_calories} ккал)
+• Белки: {new_protein}г (было {old_protein}г)
+• Жиры: {new_fat}г (было {old_fat}г)
+• Углеводы: {new_carbs}г (было {old_carbs}г)
+
+🔄 *Значения пересчитаны пропорционально новому весу*"""
+
+def _format_grams(value) -> str:
+    """Format a gram amount (float or Decimal) with up to two decimals and no trailing zeros"""
+    return f"{float(value):.2f}".rstrip('0').rstrip('.')
+
+# Edits of the same message closer than this (seconds) are coalesced to stay under flood control
+EDIT_DEBOUNCE_INTERVAL = 0.3
+_EDIT_TS_MAX_ENTRIES = 10000
+
+# Shared across TelegramService instances (one is created per webhook request)
+_last_edit_ts = {}  # (chat_id, message_id) -> monotonic time of last sent edit
+_pending_edits = {}  # (chat_id, message_id) -> threading.Timer with the latest deferred edit
+_edit_lock = threading.Lock()
+
+# Shared by all TelegramService instances so TLS connections to api.telegram.org are reused
+_http_session = create_http_session()
+
+# Non-negative number from user input; accepts both "70.5" and "70,5"
+_NUMERIC_RE = re.compile(r'^\s*(\d+(?:[.,]\d+)?)\s*$')
+
+def _parse_positive_float(text: str) -> Optional[float]:
+    """Parse a non-negative number from user input, returning None if the text is not a number"""
+    match = _NUMERIC_RE.match(text)
+    if not match:
+        return None
+    return float(match.group(1).replace(',', '.'))
+
+# Accepted body weight range for goal changes, kg
+_WEIGHT_LO, _WEIGHT_HI = 1.0, 500.0
+
+def _valid_weight(weight: float) -> bool:
+    """Check that a weight is within the accepted range"""
+    return _WEIGHT_LO <= weight <= _WEIGHT_HI
+
+# Report time in 24-hour HH:MM format; like the former int() parsing, one-digit hours and
+# minutes ("9:5" is 09:05) and spaces around the colon are accepted
+_TIME_RE = re.compile(r'^([01]?\d|2[0-3])\s*:\s*([0-5]?\d)$')
+
+_MAIN_MENU_KEYBOARD = [
+    [
+        {'text': '🍽️ Записать еду', 'callback_data': 'food_log'},
+        {'text': '📸 Анализ фото', 'callback_data': 'photo_analysis'}
+    ],
+    [
+        {'text': '📊 Дневная сводка', 'callback_data': 'summary'},
+        {'text': '📈 Статистика', 'callback_data': 'statistics'}
+    ],
+    [
+        {'text': '❓ Задать вопрос', 'callback_data': 'nutrition_question'},
+        {'text': '👤 Мой профиль', 'callback_data': 'profile'}
+    ],
+    [
+        {'text': '🔗 Подключить трекер', 'callback_data': 'connect_wearable'},
+        {'text': '⚙️ Настройки', 'callback_data': 'settings'}
+    ],
+    [
+        {'text': 'ℹ️ Помощь', 'callback_data': 'help'},
+        {'text': '📞 Поддержка', 'callback_data': 'support'}
+    ]
+]
+
+_ACTIVITY_KEYBOARD = [
+    [{'text': '1️⃣ Малоподвижный', 'callback_data': 'onboarding_activity_sedentary'}],
+    [{'text': '2️⃣ Умеренный', 'callback_data': 'onboarding_activity_moderate'}],
+    [{'text': '3️⃣ Активный', 'callback_data': 'onboarding_activity_active'}]
+]
+
+def _encode_keyboard(keyboard: list) -> str:
+    """Clean and serialize a static inline keyboard once for edit_message_with_raw_markup"""
+    return json.dumps({'inline_keyboard': clean_keyboard_markup(keyboard)}, ensure_ascii=False)
+
+_MAIN_MENU_KB_JSON = _encode_keyboard(_MAIN_MENU_KEYBOARD)
+_ACTIVITY_KB_JSON = _encode_keyboard(_ACTIVITY_KEYBOARD)
+_START_ONBOARDING_KB_JSON = _encode_keyboard([[{'text': '🚀 Начать настройку', 'callback_data': 'start_onboarding'}]])
+_BACK_TO_MAIN_KB_JSON = _encode_keyboard([[{'text': '🔙 Назад в меню', 'callback_data': 'back_to_main'}]])
+
+# (button text, field) rows of the food edit field keyboard
+_FOOD_EDIT_FIELDS = (
+    ('Калории', 'calories'),
+    ('Вес (г)', 'weight'),
+    ('Белки (г)', 'protein'),
+    ('Жиры (г)', 'fat'),
+    ('Углеводы (г)', 'carbs')
+)
+
+@lru_cache(maxsize=2048)
+def _food_edit_field_kb(log_id: str) -> str:
+    """Encoded field selection keyboard for a food log; cached since it depends only on log_id"""
+    keyboard = [[{'text': text, 'callback_data': 'food:edit_field:%s:%s' % (log_id, field)}] for text, field in _FOOD_EDIT_FIELDS]
+    keyboard.append([{'text': '🔙 Назад', 'callback_data': 'food:options:%s' % log_id}])
+    return _encode_keyboard(keyboard)
+
+# Callback routing: exact callback_data -> (handler name, extra handler args)
+_CALLBACK_ROUTES = {
+    'main_menu': ('_handle_main_menu_callback',),
+    'food_log': ('_handle_food_log_callback',),
+    'photo_analysis': ('_handle_photo_analysis_callback',),
+    'nutrition_question': ('_handle_nutrition_question_callback',),
+    'summary': ('_handle_summary_callback',),
+    'statistics': ('_handle_statistics_callback',),
+    'help': ('_handle_help_callback',),
+    'profile': ('_handle_profile_callback',),
+    'settings': ('_handle_settings_callback',),
+    'support': ('_handle_support_callback',),
+    'weekly_summary': ('_handle_weekly_summary_callback',),
+    'start_onboarding': ('_handle_start_onboarding_callback',),
+    'back_to_main': ('_handle_back_to_main_callback',),
+    'stats_today': ('_handle_stats_today_callback',),
+    'stats_week': ('_handle_stats_week_callback',),
+    'stats_month': ('_handle_stats_month_callback',),
+    'stats_progress': ('_handle_stats_progress_callback',),
+    'onboarding_goal_lose': ('_handle_onboarding_goal_callback', 'lose_weight'),
+    'onboarding_goal_maintain': ('_handle_onboarding_goal_callback', 'maintain_weight'),
+    'onboarding_goal_gain': ('_handle_onboarding_goal_callback', 'gain_weight'),
+    'onboarding_activity_sedentary': ('_handle_onboarding_activity_callback', 'sedentary'),
+    'onboarding_activity_moderate': ('_handle_onboarding_activity_callback', 'moderate'),
+    'onboarding_activity_active': ('_handle_onboarding_activity_callback', 'active'),
+    # Навигация: nav:back:<target>
+    'nav:back:settings_edit_food': ('_handle_settings_edit_food_callback',),
+    'nav:back:settings': ('_handle_settings_callback',),
+    # Настройки: settings:action
+    'settings:goal': ('_handle_settings_goal_callback',),
+    'settings:reports_time': ('_handle_settings_reports_time_callback',),
+    'settings:reset': ('_handle_settings_reset_callback',),
+    'settings:edit_food': ('_handle_settings_edit_food_callback',),
+    'settings:reset_confirm': ('_handle_settings_reset_confirm_callback',),
+    'settings:reset_cancel': ('_handle_settings_reset_cancel_callback',),
+}
+
+# Callbacks carrying an id: regex groups are passed to the handler as extra args
+# Еда: food:options:<id>, food:delete:<id>, food:edit_field:<id>:<field>
+_CALLBACK_PATTERN_ROUTES = (
+    (re.compile(r'^food:options:([^:]+)$'), '_handle_food_edit_callback'),
+    (re.compile(r'^food:delete:([^:]+)$'), '_handle_food_delete_callback'),
+    (re.compile(r'^food:edit_field:([^:]+)(?::([^:]+))?$'), '_handle_food_edit_field_callback'),
+)
+
 class TelegramService:
     def __init__(self):
         """Initialize Telegram service"""
         self.bot_token = Config.TELEGRAM_BOT_TOKEN
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
-        self.openai_service = OpenAIService()
+        self.http = _http_session
+        self.openai_service = get_openai_service()
         self.terra_service = TerraService()
     
     def process_update(self, update: Dict) -> Dict:
@@ -392,13 +546,7 @@ class TelegramService:
 
 Выберите ваш уровень активности:"""
                 
-                keyboard = [
-                    [{'text': '1️⃣ Малоподвижный', 'callback_data': 'onboarding_activity_sedentary'}],
-                    [{'text': '2️⃣ Умеренный', 'callback_data': 'onboarding_activity_moderate'}],
-                    [{'text': '3️⃣ Активный', 'callback_data': 'onboarding_activity_active'}]
-                ]
-                
-                self.send_message_with_keyboard(chat_id, message, keyboard)
+                self.send_message_with_keyboard(chat_id, message, _ACTIVITY_KEYBOARD)
                 return {'status': 'success', 'action': 'activity_selection_shown'}
             else:
                 # Onboarding complete, calculate targets
@@ -582,31 +730,30 @@ class TelegramService:
         return {'status': 'success'}
     
     def _handle_current_weight_input(self, health_service, user_id: int, chat_id: int, text: str) -> Dict:
-        try:
-            weight = float(text.strip())
-            if 30 <= weight <= 300:
-                health_service.update_user_profile(user_id, {'current_weight_kg': weight})
-                
-                # Show goal selection buttons immediately after saving current weight
-                message = """Какова ваша основная цель?
+        weight = _parse_positive_float(text)
+        if weight is None:
+            self.send_message(chat_id, "Пожалуйста, введите ваш вес числом \\(например, 70\\.5\\)")
+        elif 30 <= weight <= 300:
+            health_service.update_user_profile(user_id, {'current_weight_kg': weight})
+            
+            # Show goal selection buttons immediately after saving current weight
+            message = """Какова ваша основная цель?
 
 1. Сбросить вес - Уменьшить массу тела
 2. Поддерживать вес - Оставаться на текущем весе  
 3. Набрать вес - Увеличить массу тела
 
 Выберите вашу цель:"""
-                
-                keyboard = [
-                    [{'text': '1️⃣ Сбросить вес', 'callback_data': 'onboarding_goal_lose'}],
-                    [{'text': '2️⃣ Поддерживать вес', 'callback_data': 'onboarding_goal_maintain'}],
-                    [{'text': '3️⃣ Набрать вес', 'callback_data': 'onboarding_goal_gain'}]
-                ]
-                
-                self.send_message_with_keyboard(chat_id, message, keyboard)
-            else:
-                self.send_message(chat_id, "Пожалуйста, введите корректный вес от 30 до 300 кг")
-        except ValueError:
-            self.send_message(chat_id, "Пожалуйста, введите ваш вес числом \\(например, 70\\.5\\)")
+            
+            keyboard = [
+                [{'text': '1️⃣ Сбросить вес', 'callback_data': 'onboarding_goal_lose'}],
+                [{'text': '2️⃣ Поддерживать вес', 'callback_data': 'onboarding_goal_maintain'}],
+                [{'text': '3️⃣ Набрать вес', 'callback_data': 'onboarding_goal_gain'}]
+            ]
+            
+            self.send_message_with_keyboard(chat_id, message, keyboard)
+        else:
+            self.send_message(chat_id, "Пожалуйста, введите корректный вес от 30 до 300 кг")
         return {'status': 'success'}
     
     def _handle_goal_input(self, health_service, user_id: int, chat_id: int, text: str) -> Dict:
@@ -629,47 +776,40 @@ class TelegramService:
         return {'status': 'success'}
     
     def _handle_target_weight_input(self, health_service, user_id: int, chat_id: int, text: str) -> Dict:
-        try:
-            target_weight = float(text.strip())
-            if 30 <= target_weight <= 300:
-                health_service.update_user_profile(user_id, {'target_weight_kg': target_weight})
-                
-                # Show activity selection buttons
-                message = """Какой у вас уровень активности?
+        target_weight = _parse_positive_float(text)
+        if target_weight is None:
+            self.send_message(chat_id, "Пожалуйста, введите ваш целевой вес числом (например, 65)")
+        elif 30 <= target_weight <= 300:
+            health_service.update_user_profile(user_id, {'target_weight_kg': target_weight})
+            
+            # Show activity selection buttons
+            message = """Какой у вас уровень активности?
 
 1. Малоподвижный – Минимальные физические нагрузки
 2. Умеренный - Легкие упражнения 1-3 раза в неделю
 3. Активный - Умеренные упражнения 3-5 раз в неделю
 
 Выберите ваш уровень активности:"""
-                
-                keyboard = [
-                    [{'text': '1️⃣ Малоподвижный', 'callback_data': 'onboarding_activity_sedentary'}],
-                    [{'text': '2️⃣ Умеренный', 'callback_data': 'onboarding_activity_moderate'}],
-                    [{'text': '3️⃣ Активный', 'callback_data': 'onboarding_activity_active'}]
-                ]
-                
-                self.send_message_with_keyboard(chat_id, message, keyboard)
-            else:
-                self.send_message(chat_id, "Пожалуйста, введите корректный целевой вес от 30 до 300 кг")
-        except ValueError:
-            self.send_message(chat_id, "Пожалуйста, введите ваш целевой вес числом (например, 65)")
+            
+            self.send_message_with_keyboard(chat_id, message, _ACTIVITY_KEYBOARD)
+        else:
+            self.send_message(chat_id, "Пожалуйста, введите корректный целевой вес от 30 до 300 кг")
         return {'status': 'success'}
     
     def _handle_activity_level_input(self, health_service, user_id: int, chat_id: int, text: str) -> Dict:
         activity_text = text.lower().strip()
         if activity_text in ['малоподвижный', 'сидячий', 'sedentary', 'sed']:
-            health_service.update_user_profile(user_id, {'activity_level': 'sedentary'})
+            activity_level = 'sedentary'
         elif activity_text in ['умеренный', 'moderate', 'mod']:
-            health_service.update_user_profile(user_id, {'activity_level': 'moderate'})
+            activity_level = 'moderate'
         elif activity_text in ['активный', 'active', 'act']:
-            health_service.update_user_profile(user_id, {'activity_level': 'active'})
+            activity_level = 'active'
         else:
             self.send_message(chat_id, "Пожалуйста, ответьте 'Малоподвижный', 'Умеренный' или 'Активный'")
             return {'status': 'success'}
         
-        # Onboarding complete, calculate targets
-        health_service.calculate_user_targets(user_id)
+        # Onboarding complete, save activity level and calculate targets
+        health_service.update_profile_and_recalculate(user_id, {'activity_level': activity_level})
         self.send_message(chat_id, """🎉 Настройка профиля завершена!
 
 Ваш персональный план питания готов! Я рассчитал ваши дневные нормы калорий и макронутриентов на основе ваших целей.
@@ -699,7 +839,7 @@ class TelegramService:
     def _get_file_info(self, file_id: str) -> Optional[Dict]:
         """Get file information from Telegram"""
         try:
-            response = requests.get(f"{self.base_url}/getFile", params={'file_id': file_id})
+            response = self.http.get(f"{self.base_url}/getFile", params={'file_id': file_id})
             response.raise_for_status()
             return response.json().get('result')
         except Exception as e:
@@ -722,7 +862,7 @@ class TelegramService:
             
             # Add entities if any
             if entities:
-                payload['entities'] = entities
+                payload['entities'] = [entity._asdict() for entity in entities]
             
             # Add reply markup if provided
             if reply_markup:
@@ -743,7 +883,7 @@ class TelegramService:
             logger.debug(f"Telegram payload: {payload}")
             
             # Send message
-            response = requests.post(f"{self.base_url}/sendMessage", json=payload)
+            response = self.http.post(f"{self.base_url}/sendMessage", json=payload)
             try:
                 response.raise_for_status()
             except Exception as e:
@@ -780,7 +920,7 @@ class TelegramService:
                 'allowed_updates': ['message', 'callback_query']
             }
             
-            response = requests.post(f"{self.base_url}/setWebhook", json=payload)
+            response = self.http.post(f"{self.base_url}/setWebhook", json=payload)
             response.raise_for_status()
             
             return response.json()
@@ -801,98 +941,19 @@ class TelegramService:
             logger.debug(f"Processing callback query: {callback_data}")
             self._answer_callback_query(callback_query['id'])
 
-            # Новый роутинг по формату prefix:action:id[:payload]
-            parts = callback_data.split(':')
-            if len(parts) == 1:
-                # Короткие команды (главное меню и т.д.)
-                if callback_data == 'main_menu':
-                    return self._handle_main_menu_callback(user_id, chat_id, message_id)
-                elif callback_data == 'food_log':
-                    return self._handle_food_log_callback(user_id, chat_id, message_id)
-                elif callback_data == 'photo_analysis':
-                    return self._handle_photo_analysis_callback(user_id, chat_id, message_id)
-                elif callback_data == 'nutrition_question':
-                    return self._handle_nutrition_question_callback(user_id, chat_id, message_id)
-                elif callback_data == 'summary':
-                    return self._handle_summary_callback(user_id, chat_id, message_id)
-                elif callback_data == 'statistics':
-                    return self._handle_statistics_callback(user_id, chat_id, message_id)
-                elif callback_data == 'help':
-                    return self._handle_help_callback(user_id, chat_id, message_id)
-                elif callback_data == 'profile':
-                    return self._handle_profile_callback(user_id, chat_id, message_id)
-                elif callback_data == 'settings':
-                    return self._handle_settings_callback(user_id, chat_id, message_id)
-                elif callback_data == 'support':
-                    return self._handle_support_callback(user_id, chat_id, message_id)
-                elif callback_data == 'weekly_summary':
-                    return self._handle_weekly_summary_callback(user_id, chat_id, message_id)
-                elif callback_data == 'start_onboarding':
-                    return self._handle_start_onboarding_callback(user_id, chat_id, message_id)
-                elif callback_data == 'back_to_main':
-                    return self._handle_back_to_main_callback(user_id, chat_id, message_id)
-                elif callback_data == 'stats_today':
-                    return self._handle_stats_today_callback(user_id, chat_id, message_id)
-                elif callback_data == 'stats_week':
-                    return self._handle_stats_week_callback(user_id, chat_id, message_id)
-                elif callback_data == 'stats_month':
-                    return self._handle_stats_month_callback(user_id, chat_id, message_id)
-                elif callback_data == 'stats_progress':
-                    return self._handle_stats_progress_callback(user_id, chat_id, message_id)
-                elif callback_data == 'onboarding_goal_lose':
-                    return self._handle_onboarding_goal_callback(user_id, chat_id, message_id, 'lose_weight')
-                elif callback_data == 'onboarding_goal_maintain':
-                    return self._handle_onboarding_goal_callback(user_id, chat_id, message_id, 'maintain_weight')
-                elif callback_data == 'onboarding_goal_gain':
-                    return self._handle_onboarding_goal_callback(user_id, chat_id, message_id, 'gain_weight')
-                elif callback_data == 'onboarding_activity_sedentary':
-                    return self._handle_onboarding_activity_callback(user_id, chat_id, message_id, 'sedentary')
-                elif callback_data == 'onboarding_activity_moderate':
-                    return self._handle_onboarding_activity_callback(user_id, chat_id, message_id, 'moderate')
-                elif callback_data == 'onboarding_activity_active':
-                    return self._handle_onboarding_activity_callback(user_id, chat_id, message_id, 'active')
-                # ... другие короткие команды ...
-                else:
-                    logger.warning(f"Unknown callback data: {callback_data}")
-                    return {'status': 'ignored', 'reason': 'Unknown callback data'}
-            else:
-                prefix = parts[0]
-                action = parts[1] if len(parts) > 1 else None
-                obj_id = parts[2] if len(parts) > 2 else None
-                payload = parts[3] if len(parts) > 3 else None
-                # Еда: food:options:<id>, food:delete:<id>, food:edit_field:<id>:<field>
-                if prefix == 'food':
-                    if action == 'options':
-                        return self._handle_food_edit_callback(user_id, chat_id, message_id, obj_id)
-                    elif action == 'delete':
-                        return self._handle_food_delete_callback(user_id, chat_id, message_id, obj_id)
-                    elif action == 'edit_field':
-                        return self._handle_food_edit_field_callback(user_id, chat_id, message_id, obj_id, payload)
-                # Навигация: nav:back:<target>
-                elif prefix == 'nav' and action == 'back':
-                    # Например, nav:back:settings_edit_food
-                    if obj_id == 'settings_edit_food':
-                        return self._handle_settings_edit_food_callback(user_id, chat_id, message_id)
-                    elif obj_id == 'settings':
-                        return self._handle_settings_callback(user_id, chat_id, message_id)
-                    # ... другие возвраты ...
-                # Настройки: settings:action
-                elif prefix == 'settings':
-                    if action == 'goal':
-                        return self._handle_settings_goal_callback(user_id, chat_id, message_id)
-                    elif action == 'reports_time':
-                        return self._handle_settings_reports_time_callback(user_id, chat_id, message_id)
-                    elif action == 'reset':
-                        return self._handle_settings_reset_callback(user_id, chat_id, message_id)
-                    elif action == 'edit_food':
-                        return self._handle_settings_edit_food_callback(user_id, chat_id, message_id)
-                    elif action == 'reset_confirm':
-                        return self._handle_settings_reset_confirm_callback(user_id, chat_id, message_id)
-                    elif action == 'reset_cancel':
-                        return self._handle_settings_reset_cancel_callback(user_id, chat_id, message_id)
-                # ... другие кастомные роуты ...
-                logger.warning(f"Unknown structured callback data: {callback_data}")
-                return {'status': 'ignored', 'reason': 'Unknown structured callback data'}
+            # Constant callbacks are a single dict lookup, id-carrying ones are matched by pattern
+            route = _CALLBACK_ROUTES.get(callback_data)
+            if route:
+                handler_name, *args = route
+                return getattr(self, handler_name)(user_id, chat_id, message_id, *args)
+            
+            for pattern, handler_name in _CALLBACK_PATTERN_ROUTES:
+                match = pattern.match(callback_data)
+                if match:
+                    return getattr(self, handler_name)(user_id, chat_id, message_id, *match.groups())
+            
+            logger.warning(f"Unknown callback data: {callback_data}")
+            return {'status': 'ignored', 'reason': 'Unknown callback data'}
         except Exception as e:
             logger.error(f"Error processing callback query: {str(e)}")
             return {'status': 'error', 'error': str(e)}
@@ -904,7 +965,7 @@ class TelegramService:
             if text:
                 payload['text'] = text
             
-            response = requests.post(f"{self.base_url}/answerCallbackQuery", json=payload)
+            response = self.http.post(f"{self.base_url}/answerCallbackQuery", json=payload)
             response.raise_for_status()
             return True
             
@@ -932,6 +993,70 @@ class TelegramService:
             return False
     
     def edit_message_with_keyboard(self, chat_id: int, message_id: int, text: str, keyboard: list) -> bool:
+        """
+        Edit message with inline keyboard, debouncing rapid edits of the same message.
+
+        If the message was edited less than EDIT_DEBOUNCE_INTERVAL ago, the edit is
+        deferred and replaces any edit still pending for that message, so a burst of
+        callback taps results in a single API call with the latest content.
+        """
+        return self._debounced_edit(chat_id, message_id, partial(self._edit_message_now, chat_id, message_id, text, keyboard))
+    
+    def edit_message_with_raw_markup(self, chat_id: int, message_id: int, text: str, reply_markup_json: str) -> bool:
+        """
+        Edit message using an already serialized and cleaned reply_markup.
+
+        Intended for static keyboards encoded once at import time (see _encode_keyboard),
+        so the keyboard is not cleaned and JSON-encoded again on every call.
+        Debounced the same way as edit_message_with_keyboard.
+        """
+        return self._debounced_edit(chat_id, message_id, partial(self._edit_message_raw_now, chat_id, message_id, text, reply_markup_json))
+    
+    def _debounced_edit(self, chat_id: int, message_id: int, send_edit) -> bool:
+        """Run send_edit now, or defer it if the message was edited too recently"""
+        key = (chat_id, message_id)
+        with _edit_lock:
+            pending = _pending_edits.pop(key, None)
+            if pending:
+                pending.cancel()
+            
+            now = monotonic()
+            last_edit = _last_edit_ts.get(key)
+            if last_edit is not None and now - last_edit < EDIT_DEBOUNCE_INTERVAL:
+                timer = threading.Timer(
+                    EDIT_DEBOUNCE_INTERVAL - (now - last_edit),
+                    self._flush_pending_edit,
+                    args=(key, send_edit)
+                )
+                timer.daemon = True
+                _pending_edits[key] = timer
+                timer.start()
+                logger.debug(f"Deferred edit for chat {chat_id}, message {message_id}")
+                return True
+            
+            self._record_edit(key, now)
+        
+        return send_edit()
+    
+    def _flush_pending_edit(self, key: tuple, send_edit) -> None:
+        """Send a deferred edit unless it was superseded by a newer one"""
+        with _edit_lock:
+            if _pending_edits.get(key) is not threading.current_thread():
+                return
+            del _pending_edits[key]
+            self._record_edit(key, monotonic())
+        
+        send_edit()
+    
+    @staticmethod
+    def _record_edit(key: tuple, timestamp: float) -> None:
+        """Remember edit time for a message, pruning stale entries (caller holds _edit_lock)"""
+        if len(_last_edit_ts) >= _EDIT_TS_MAX_ENTRIES:
+            for stale_key in [k for k, ts in _last_edit_ts.items() if timestamp - ts >= EDIT_DEBOUNCE_INTERVAL]:
+                del _last_edit_ts[stale_key]
+        _last_edit_ts[key] = timestamp
+    
+    def _edit_message_now(self, chat_id: int, message_id: int, text: str, keyboard: list) -> bool:
         """Edit message with inline keyboard using new entity system"""
         try:
             # Parse markdown to entities
@@ -952,12 +1077,12 @@ class TelegramService:
             
             # Add entities if any
             if entities:
-                payload['entities'] = entities
+                payload['entities'] = [entity._asdict() for entity in entities]
             
             # Debug logging
             logger.debug(f"Editing message payload: {payload}")
             
-            response = requests.post(f"{self.base_url}/editMessageText", json=payload)
+            response = self.http.post(f"{self.base_url}/editMessageText", json=payload)
             
             if not response.ok:
                 logger.error(f"Telegram API error: {response.status_code} - {response.text}")
@@ -971,30 +1096,45 @@ class TelegramService:
             logger.error(f"Chat ID: {chat_id}, Message ID: {message_id}, Text: {text[:100]}...")
             return False
     
+    def _edit_message_raw_now(self, chat_id: int, message_id: int, text: str, reply_markup_json: str) -> bool:
+        """Edit message splicing a pre-serialized reply_markup into the request body"""
+        try:
+            # Parse markdown to entities
+            plain_text, entities = parse_markdown_to_entities(text)
+            
+            payload = {
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'text': plain_text
+            }
+            if entities:
+                payload['entities'] = [entity._asdict() for entity in entities]
+            
+            # Append reply_markup to the serialized payload object
+            body = json.dumps(payload, ensure_ascii=False)[:-1] + ', "reply_markup": ' + reply_markup_json + '}'
+            logger.debug(f"Editing message body: {body}")
+            
+            response = self.http.post(
+                f"{self.base_url}/editMessageText",
+                data=body.encode('utf-8'),
+                headers={'Content-Type': 'application/json'}
+            )
+            
+            if not response.ok:
+                logger.error(f"Telegram API error: {response.status_code} - {response.text}")
+                logger.error(f"Body was: {body}")
+            
+            response.raise_for_status()
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error editing message with raw markup: {str(e)}")
+            logger.error(f"Chat ID: {chat_id}, Message ID: {message_id}, Text: {text[:100]}...")
+            return False
+    
     def _get_main_menu_keyboard(self) -> list:
         """Get main menu keyboard"""
-        return [
-            [
-                {'text': '🍽️ Записать еду', 'callback_data': 'food_log'},
-                {'text': '📸 Анализ фото', 'callback_data': 'photo_analysis'}
-            ],
-            [
-                {'text': '📊 Дневная сводка', 'callback_data': 'summary'},
-                {'text': '📈 Статистика', 'callback_data': 'statistics'}
-            ],
-            [
-                {'text': '❓ Задать вопрос', 'callback_data': 'nutrition_question'},
-                {'text': '👤 Мой профиль', 'callback_data': 'profile'}
-            ],
-            [
-                {'text': '🔗 Подключить трекер', 'callback_data': 'connect_wearable'},
-                {'text': '⚙️ Настройки', 'callback_data': 'settings'}
-            ],
-            [
-                {'text': 'ℹ️ Помощь', 'callback_data': 'help'},
-                {'text': '📞 Поддержка', 'callback_data': 'support'}
-            ]
-        ]
+        return [list(row) for row in _MAIN_MENU_KEYBOARD]
     
     def _get_back_keyboard(self) -> list:
         """Get back to main menu keyboard"""
@@ -1889,13 +2029,12 @@ class TelegramService:
             
             # Add entities if any
             if entities:
-                payload['entities'] = entities
+                payload['entities'] = [entity._asdict() for entity in entities]
             
             # Build inline keyboard
             if inline_keyboard:
-                cleaned_keyboard = clean_keyboard_markup(inline_keyboard)
-                # Add main menu button to the keyboard
-                cleaned_keyboard.append([{'text': '🎯 Главное меню', 'callback_data': 'main_menu'}])
+                # Add main menu button to the keyboard (without modifying the caller's list)
+                cleaned_keyboard = clean_keyboard_markup(inline_keyboard) + [[{'text': '🎯 Главное меню', 'callback_data': 'main_menu'}]]
             else:
                 # If no keyboard provided, create one with just main menu button
                 cleaned_keyboard = [[{'text': '🎯 Главное меню', 'callback_data': 'main_menu'}]]
@@ -1908,7 +2047,7 @@ class TelegramService:
             logger.debug(f"Telegram payload with main menu: {payload}")
             
             # Send message
-            response = requests.post(f"{self.base_url}/sendMessage", json=payload)
+            response = self.http.post(f"{self.base_url}/sendMessage", json=payload)
             try:
                 response.raise_for_status()
             except Exception as e:
@@ -1932,8 +2071,12 @@ class TelegramService:
             logger.error(f"Error handling main menu text: {str(e)}")
             return {'status': 'error', 'error': str(e)}
     
-    def send_main_menu_message(self, chat_id: int, user_id: int, message_id: int = None) -> Dict:
-        """Send unified main menu message with full user profile"""
+    def send_status_and_menu(self, chat_id: int, user_id: int, status_text: str) -> Dict:
+        """Send a status message and the main menu as a single Telegram message"""
+        return self.send_main_menu_message(chat_id, user_id, status_text=status_text)
+    
+    def send_main_menu_message(self, chat_id: int, user_id: int, message_id: int = None, status_text: str = None) -> Dict:
+        """Send unified main menu message with full user profile, optionally prefixed with a status text"""
         db = None
         try:
             db = next(get_db())
@@ -1960,6 +2103,9 @@ class TelegramService:
 Выберите действие:"""
                 keyboard = self._get_main_menu_keyboard()
             
+            if status_text:
+                message = f"{status_text}\n\n{message}"
+            
             # Send or edit message based on whether message_id is provided
             if message_id:
                 self.edit_message_with_keyboard(chat_id, message_id, message, keyboard)
@@ -2076,13 +2222,14 @@ class TelegramService:
             success = health_service.update_user_profile(user_id, reset_data)
             
             if success:
+                invalidate_terra_user_cache(user_id)
                 message = "✅ Профиль успешно сброшен! Теперь давайте настроим его заново."
-                keyboard = [[{'text': '🚀 Начать настройку', 'callback_data': 'start_onboarding'}]]
+                reply_markup_json = _START_ONBOARDING_KB_JSON
             else:
                 message = "❌ Ошибка при сбросе профиля. Попробуйте позже."
-                keyboard = [[{'text': '🔙 Назад в меню', 'callback_data': 'back_to_main'}]]
+                reply_markup_json = _BACK_TO_MAIN_KB_JSON
             
-            self.edit_message_with_keyboard(chat_id, message_id, message, keyboard)
+            self.edit_message_with_raw_markup(chat_id, message_id, message, reply_markup_json)
             return {'status': 'success', 'action': 'profile_reset'}
             
         except Exception as e:
@@ -2117,9 +2264,8 @@ class TelegramService:
             message = "Выберите приём пищи, который хотите изменить или удалить:"
             keyboard = []
             for food_log in food_logs:
-                dish_name = food_log.dish_name[:20] + "..." if len(food_log.dish_name) > 20 else food_log.dish_name
                 weight_text = f"{food_log.estimated_weight_g}г" if food_log.estimated_weight_g else "~г"
-                button_text = f"{dish_name} - {food_log.calories} ккал, {weight_text}"
+                button_text = f"{food_log.short_name} - {food_log.calories} ккал, {weight_text}"
                 callback_data = f'food:options:{food_log.log_id}'
                 keyboard.append([{'text': button_text, 'callback_data': callback_data}])
             keyboard.append([{'text': '🔙 Назад в настройки', 'callback_data': 'nav:back:settings'}])
@@ -2154,15 +2300,7 @@ class TelegramService:
         try:
             if field == 'select':
                 message = "Какое поле вы хотите изменить?"
-                keyboard = [
-                    [{'text': 'Калории', 'callback_data': f'food:edit_field:{log_id}:calories'}],
-                    [{'text': 'Вес (г)', 'callback_data': f'food:edit_field:{log_id}:weight'}],
-                    [{'text': 'Белки (г)', 'callback_data': f'food:edit_field:{log_id}:protein'}],
-                    [{'text': 'Жиры (г)', 'callback_data': f'food:edit_field:{log_id}:fat'}],
-                    [{'text': 'Углеводы (г)', 'callback_data': f'food:edit_field:{log_id}:carbs'}]
-                ]
-                keyboard.append([{'text': '🔙 Назад', 'callback_data': f'food:options:{log_id}'}])
-                self.edit_message_with_keyboard(chat_id, message_id, message, keyboard)
+                self.edit_message_with_raw_markup(chat_id, message_id, message, _food_edit_field_kb(log_id))
                 return {'status': 'success', 'action': 'food_edit_field_selection'}
             
             # Handle specific field selection
@@ -2233,8 +2371,11 @@ class TelegramService:
     def _handle_goal_change_current_weight(self, user_id: int, chat_id: int, text: str, health_service) -> Dict:
         """Handle current weight input for goal change"""
         try:
-            weight = float(text.strip())
-            if weight <= 0 or weight > 500:
+            weight = _parse_positive_float(text)
+            if weight is None:
+                self.send_message(chat_id, "Пожалуйста, введите число (например, 70.5):")
+                return {'status': 'success', 'action': 'invalid_input'}
+            if not _valid_weight(weight):
                 self.send_message(chat_id, "Пожалуйста, введите корректный вес (от 1 до 500 кг):")
                 return {'status': 'success', 'action': 'invalid_weight'}
             
@@ -2244,9 +2385,6 @@ class TelegramService:
             self.send_message(chat_id, "Введите ваш желаемый вес (кг):")
             return {'status': 'success', 'action': 'target_weight_requested'}
             
-        except ValueError:
-            self.send_message(chat_id, "Пожалуйста, введите число (например, 70.5):")
-            return {'status': 'success', 'action': 'invalid_input'}
         except Exception as e:
             logger.error(f"Error handling current weight input: {str(e)}")
             state_manager.clear_state(user_id)
@@ -2255,8 +2393,11 @@ class TelegramService:
     def _handle_goal_change_target_weight(self, user_id: int, chat_id: int, text: str, health_service) -> Dict:
         """Handle target weight input for goal change"""
         try:
-            target_weight = float(text.strip())
-            if target_weight <= 0 or target_weight > 500:
+            target_weight = _parse_positive_float(text)
+            if target_weight is None:
+                self.send_message(chat_id, "Пожалуйста, введите число (например, 65.0):")
+                return {'status': 'success', 'action': 'invalid_input'}
+            if not _valid_weight(target_weight):
                 self.send_message(chat_id, "Пожалуйста, введите корректный вес (от 1 до 500 кг):")
                 return {'status': 'success', 'action': 'invalid_weight'}
             
@@ -2278,12 +2419,9 @@ class TelegramService:
                 'target_weight_kg': target_weight
             }
             
-            success = health_service.update_user_profile(user_id, updates)
+            success = health_service.update_profile_and_recalculate(user_id, updates)
             
             if success:
-                # Recalculate targets
-                health_service.calculate_user_targets(user_id)
-                
                 # Get updated profile
                 user_profile = health_service.get_user_profile(user_id)
                 
@@ -2299,17 +2437,14 @@ class TelegramService:
 • Жиры: {user_profile.daily_fat_target_g}г
 • Углеводы: {user_profile.daily_carbs_target_g}г"""
                 
-                # Clear state and show main menu
+                # Clear state and show result together with main menu
                 state_manager.clear_state(user_id)
-                return self.send_main_menu_message(chat_id, user_id)
+                return self.send_status_and_menu(chat_id, user_id, message)
             else:
                 self.send_message(chat_id, "❌ Ошибка при обновлении целей. Попробуйте позже.")
                 state_manager.clear_state(user_id)
                 return {'status': 'error', 'error': 'Failed to update goals'}
             
-        except ValueError:
-            self.send_message(chat_id, "Пожалуйста, введите число (например, 65.0):")
-            return {'status': 'success', 'action': 'invalid_input'}
         except Exception as e:
             logger.error(f"Error handling target weight input: {str(e)}")
             state_manager.clear_state(user_id)
@@ -2321,15 +2456,12 @@ class TelegramService:
             # Parse time input (HH:MM format)
             time_str = text.strip()
             
-            # Validate time format
-            try:
-                hour, minute = map(int, time_str.split(':'))
-                if not (0 <= hour <= 23 and 0 <= minute <= 59):
-                    raise ValueError("Invalid time range")
-                report_time = time(hour, minute)
-            except (ValueError, TypeError):
+            # Validate time format and range in one match
+            match = _TIME_RE.match(time_str)
+            if not match:
                 self.send_message(chat_id, "Пожалуйста, введите время в формате ЧЧ:ММ (например, 21:00):")
                 return {'status': 'success', 'action': 'invalid_time_format'}
+            report_time = time(int(match.group(1)), int(match.group(2)))
             
             # Update user profile
             success = health_service.update_user_profile(user_id, {'daily_report_time': report_time})
@@ -2337,7 +2469,7 @@ class TelegramService:
             if success:
                 message = f"✅ Время ежедневного отчета установлено на {time_str} (МСК)"
                 state_manager.clear_state(user_id)
-                return self.send_main_menu_message(chat_id, user_id)
+                return self.send_status_and_menu(chat_id, user_id, message)
             else:
                 self.send_message(chat_id, "❌ Ошибка при установке времени. Попробуйте позже.")
                 state_manager.clear_state(user_id)
@@ -2360,11 +2492,8 @@ class TelegramService:
                 return {'status': 'error', 'error': 'Missing log_id'}
             
             # Parse the new value
-            try:
-                new_value = float(text.strip())
-                if new_value < 0:
-                    raise ValueError("Negative value")
-            except ValueError:
+            new_value = _parse_positive_float(text)
+            if new_value is None:
                 self.send_message(chat_id, "Пожалуйста, введите положительное число:")
                 return {'status': 'success', 'action': 'invalid_input'}
             
@@ -2389,7 +2518,20 @@ class TelegramService:
                 self.send_message(chat_id, "Ошибка: запись о еде не найдена.")
                 state_manager.clear_state(user_id)
                 return {'status': 'error', 'error': 'Food log not found'}
-            
+
+            # A weight edit recalculates nutrition only if the log already has a weight
+            recalculated = field == 'estimated_weight_g' and bool(current_food_log.estimated_weight_g)
+            if recalculated:
+                # Snapshot old values (the session returns the same object after the update),
+                # formatted like the new ones since the Numeric columns come back as Decimal
+                message_values = {
+                    'old_weight': _format_grams(current_food_log.estimated_weight_g),
+                    'old_calories': int(current_food_log.calories),
+                    'old_protein': _format_grams(current_food_log.protein_g),
+                    'old_fat': _format_grams(current_food_log.fat_g),
+                    'old_carbs': _format_grams(current_food_log.carbs_g)
+                }
+
             # Update the food log
             success = health_service.update_food_log(log_id, {field: new_value})
             
@@ -2408,24 +2550,22 @@ class TelegramService:
                 field_name = field_names.get(field, field)
                 
                 # Create success message
-                if field == 'estimated_weight_g':
+                if recalculated:
                     # Show recalculated nutrition values when weight is changed
-                    message = f"""✅ *Вес успешно обновлен!*
-
-📊 *Новые значения:*
-• Вес: {new_value}г (было {float(current_food_log.estimated_weight_g)}г)
-• Калории: {int(updated_food_log.calories)} ккал (было {int(current_food_log.calories)} ккал)
-• Белки: {float(updated_food_log.protein_g)}г (было {float(current_food_log.protein_g)}г)
-• Жиры: {float(updated_food_log.fat_g)}г (было {float(current_food_log.fat_g)}г)
-• Углеводы: {float(updated_food_log.carbs_g)}г (было {float(current_food_log.carbs_g)}г)
-
-🔄 *Значения пересчитаны пропорционально новому весу*"""
+                    message_values.update(
+                        new_weight=_format_grams(new_value),
+                        new_calories=int(updated_food_log.calories),
+                        new_protein=_format_grams(updated_food_log.protein_g),
+                        new_fat=_format_grams(updated_food_log.fat_g),
+                        new_carbs=_format_grams(updated_food_log.carbs_g)
+                    )
+                    message = _FOOD_UPDATE_TEMPLATE.format_map(message_values)
                 else:
                     # For other fields, show simple update message
                     message = f"✅ {field_name} успешно обновлено на {new_value}"
                 
                 state_manager.clear_state(user_id)
-                return self.send_main_menu_message(chat_id, user_id)
+                return self.send_status_and_menu(chat_id, user_id, message)
             else:
                 self.send_message(chat_id, "❌ Ошибка при обновлении записи. Попробуйте позже.")
                 state_manager.clear_state(user_id)
@@ -2459,13 +2599,7 @@ class TelegramService:
 
 Выберите ваш уровень активности:"""
                 
-                keyboard = [
-                    [{'text': '1️⃣ Малоподвижный', 'callback_data': 'onboarding_activity_sedentary'}],
-                    [{'text': '2️⃣ Умеренный', 'callback_data': 'onboarding_activity_moderate'}],
-                    [{'text': '3️⃣ Активный', 'callback_data': 'onboarding_activity_active'}]
-                ]
-                
-                self.edit_message_with_keyboard(chat_id, message_id, message, keyboard)
+                self.edit_message_with_raw_markup(chat_id, message_id, message, _ACTIVITY_KB_JSON)
             else:
                 # Ask for target weight
                 message = "Какой у вас целевой вес в килограммах? (например, 65)"
@@ -2487,11 +2621,8 @@ class TelegramService:
             db = next(get_db())
             health_service = HealthService(db)
             
-            # Update user profile with selected activity level
-            health_service.update_user_profile(user_id, {'activity_level': activity})
-            
-            # Calculate user targets
-            health_service.calculate_user_targets(user_id)
+            # Update activity level and calculate user targets
+            health_service.update_profile_and_recalculate(user_id, {'activity_level': activity})
             
             # Get updated profile to show calculated values
             user_profile = health_service.get_user_profile(user_id)
@@ -2515,8 +2646,7 @@ class TelegramService:
 
 Давайте начнем ваш путь к здоровью! Отправьте мне фотографию или описание вашего следующего приема пищи."""
             
-            keyboard = self._get_main_menu_keyboard()
-            self.edit_message_with_keyboard(chat_id, message_id, message, keyboard)
+            self.edit_message_with_raw_markup(chat_id, message_id, message, _MAIN_MENU_KB_JSON)
             return {'status': 'success', 'activity': activity}
             
         except Exception as e:
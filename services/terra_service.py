@@ -1,15 +1,87 @@
-import requests
 import json
 import logging
-from typing import Dict, Optional
+import queue
+import threading
+from time import monotonic
+from typing import Dict, List, Optional, Union
 from config.settings import Config
 from database.connection import get_db
+from utils.http_utils import create_http_session
 from models.user_profile import UserProfile
 from models.activity_log import ActivityLog
 from datetime import date
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 logger = logging.getLogger(__name__)
 
+# Seconds to wait for Terra API (connect and read) before giving up and freeing the worker
+TERRA_REQUEST_TIMEOUT = 10
+
+# Shared by all TerraService instances so TLS connections to api.tryterra.co are reused
+_http_session = create_http_session()
+
+# terra_user_id -> (user_id, expiry); the mapping changes only on auth or profile reset.
+# The TTL bounds staleness across worker processes, which do not see each other's invalidations.
+TERRA_USER_CACHE_TTL = 3600
+_TERRA_USER_CACHE_MAX_ENTRIES = 10000
+_terra_user_cache = {}
+_terra_user_cache_lock = threading.Lock()
+
+def invalidate_terra_user_cache(user_id: int, terra_user_id: Optional[str] = None) -> None:
+    """
+    Forget cached Terra mappings of a user, e.g. after the profile is reset or re-authenticated.
+    Pass terra_user_id on (re)authentication: that account may still be cached for another user.
+    """
+    with _terra_user_cache_lock:
+        for tid in [tid for tid, (uid, _) in _terra_user_cache.items() if uid == user_id]:
+            del _terra_user_cache[tid]
+        if terra_user_id is not None:
+            _terra_user_cache.pop(terra_user_id, None)
+
+# Widget session URLs are reused for repeated "connect" clicks; Terra keeps them valid longer than this
+AUTH_URL_CACHE_TTL = 300
+_auth_url_cache = {}  # str(user_id) -> (url, expiry)
+_auth_url_cache_lock = threading.Lock()
+
+# Webhooks are acknowledged right away and written to the database by a background worker.
+# The queue lives in process memory: payloads still queued when the process exits are lost,
+# and Terra does not resend webhooks it already got a 200 for.
+WEBHOOK_QUEUE_MAX_SIZE = 10000
+WEBHOOK_BATCH_MAX_SIZE = 100
+_webhook_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_MAX_SIZE)
+_webhook_worker = None
+_webhook_worker_lock = threading.Lock()
+
+def _run_webhook_worker() -> None:
+    """Drain queued webhooks, processing everything already waiting as one batch"""
+    terra_service = TerraService()
+    while True:
+        batch = [_webhook_queue.get()]
+        while len(batch) < WEBHOOK_BATCH_MAX_SIZE:
+            try:
+                batch.append(_webhook_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            terra_service.process_webhook(batch)
+        except Exception as e:
+            logger.error(f"Error processing queued Terra webhooks: {str(e)}")
+        finally:
+            for _ in batch:
+                _webhook_queue.task_done()
+
+def _ensure_webhook_worker() -> None:
+    """Start the webhook worker thread on first use (lazily, so it runs in each server process)"""
+    global _webhook_worker
+    if _webhook_worker is not None and _webhook_worker.is_alive():
+        return
+    with _webhook_worker_lock:
+        if _webhook_worker is None or not _webhook_worker.is_alive():
+            _webhook_worker = threading.Thread(target=_run_webhook_worker, name='terra-webhook-worker', daemon=True)
+            _webhook_worker.start()
+
 class TerraService:
     def __init__(self):
         """Initialize Terra service with API credentials"""
@@ -21,10 +93,17 @@ class TerraService:
             'x-api-key': self.api_key,
             'Content-Type': 'application/json'
         }
+        self.http = _http_session
     
     def generate_auth_url(self, user_id: int) -> str:
-        """Generate Terra authentication URL for a user"""
+        """Generate Terra authentication URL for a user, reusing a recent one if available"""
         try:
+            cache_key = str(user_id)
+            now = monotonic()
+            cached = _auth_url_cache.get(cache_key)
+            if cached and cached[1] > now:
+                return cached[0]
+            
             endpoint = f"{self.base_url}/v2/auth/generateWidgetSession"
             
             payload = {
@@ -34,19 +113,45 @@ class TerraService:
                 "auth_failure_redirect_url": "https://failure.tryterra.co/"
             }
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
+            response = self.http.post(endpoint, headers=self.headers, json=payload, timeout=TERRA_REQUEST_TIMEOUT)
             response.raise_for_status()
             
             data = response.json()
-            return data.get('url')
+            url = data.get('url')
+            if url:
+                with _auth_url_cache_lock:
+                    # Drop expired sessions so the cache only holds users mid-connection
+                    for key in [k for k, (_, expiry) in _auth_url_cache.items() if expiry <= now]:
+                        del _auth_url_cache[key]
+                    _auth_url_cache[cache_key] = (url, now + AUTH_URL_CACHE_TTL)
+            return url
             
         except Exception as e:
             logger.error(f"Error generating Terra auth URL: {str(e)}")
             raise
     
-    def process_webhook(self, webhook_data: Dict) -> Dict:
-        """Process incoming Terra webhook data"""
+    def enqueue_webhook(self, webhook_data: Union[Dict, List[Dict]]) -> Dict:
+        """Queue webhook data for background processing and return immediately"""
+        payloads = webhook_data if isinstance(webhook_data, list) else [webhook_data]
+        _ensure_webhook_worker()
+        
+        for index, payload in enumerate(payloads):
+            try:
+                _webhook_queue.put_nowait(payload)
+            except queue.Full:
+                # Queue is backed up: process the rest inline so nothing acknowledged is dropped
+                logger.warning("Terra webhook queue is full, processing webhook synchronously")
+                self.process_webhook(payloads[index:])
+                return {'status': 'success', 'queued': index}
+        
+        return {'status': 'accepted', 'queued': len(payloads)}
+    
+    def process_webhook(self, webhook_data: Union[Dict, List[Dict]]) -> Dict:
+        """Process incoming Terra webhook data (a single payload or a batch of payloads)"""
         try:
+            if isinstance(webhook_data, list):
+                return self._process_webhook_batch(webhook_data)
+            
             webhook_type = webhook_data.get('type')
             
             if webhook_type == 'auth':
@@ -63,10 +168,61 @@ class TerraService:
             logger.error(f"Error processing Terra webhook: {str(e)}")
             raise
     
+    def _process_webhook_batch(self, payloads: List[Dict]) -> Dict:
+        """
+        Process a batch of webhooks, merging activity and sleep data per user into one upsert each.
+        A failing payload is logged and skipped so it does not abort the rest of the batch; if a
+        merged payload fails, its original webhooks are retried one by one.
+        """
+        results = []
+        merged_payloads = {}
+        original_payloads = {}  # (type, terra_user_id) -> payloads merged under that key
+        for payload in payloads:
+            webhook_type = payload.get('type')
+            terra_user_id = (payload.get('user') or {}).get('user_id')
+            
+            if webhook_type in ('activity', 'sleep') and terra_user_id:
+                merged = merged_payloads.get((webhook_type, terra_user_id))
+                if merged is None:
+                    merged = merged_payloads[(webhook_type, terra_user_id)] = {
+                        'type': webhook_type,
+                        'user': payload['user'],
+                        'data': []
+                    }
+                merged['data'].extend(payload.get('data') or [])
+                original_payloads.setdefault((webhook_type, terra_user_id), []).append(payload)
+            else:
+                results.append(self._process_batch_item(payload))
+        
+        # Auth webhooks are handled first so data in the same batch can be matched to the user
+        for key, merged in merged_payloads.items():
+            originals = original_payloads[key]
+            if len(originals) == 1:
+                results.append(self._process_batch_item(merged))
+                continue
+            try:
+                results.append(self.process_webhook(merged))
+            except Exception as e:
+                # Keep one bad webhook from losing the user's other webhooks in the batch
+                logger.error(f"Retrying {len(originals)} merged Terra {key[0]} webhooks for {key[1]} one by one: {str(e)}")
+                results.extend(self._process_batch_item(payload) for payload in originals)
+        
+        logger.info(f"Processed batch of {len(payloads)} Terra webhooks")
+        return {'status': 'success', 'processed_webhooks': len(payloads), 'results': results}
+    
+    def _process_batch_item(self, webhook_data: Dict) -> Dict:
+        """Process one payload of a batch, reporting a failure as an error result instead of raising"""
+        try:
+            return self.process_webhook(webhook_data)
+        except Exception as e:
+            terra_user_id = (webhook_data.get('user') or {}).get('user_id')
+            logger.error(f"Dropping Terra {webhook_data.get('type')} webhook for {terra_user_id}: {str(e)}")
+            return {'status': 'error', 'reason': str(e)}
+    
     def _process_auth_webhook(self, webhook_data: Dict) -> Dict:
         """Process Terra authentication webhook"""
         try:
-            user_data = webhook_data.get('user', {})
+            user_data = webhook_data.get('user') or {}
             terra_user_id = user_data.get('user_id')
             reference_id = user_data.get('reference_id')  # Our Telegram user ID
             
@@ -81,6 +237,8 @@ class TerraService:
             if user_profile:
                 user_profile.terra_user_id = terra_user_id
                 db.commit()
+                invalidate_terra_user_cache(user_profile.user_id, terra_user_id)
+                _auth_url_cache.pop(str(user_profile.user_id), None)
                 logger.info(f"Updated user {reference_id} with Terra user ID: {terra_user_id}")
                 return {'status': 'success', 'message': 'User authenticated with Terra'}
             else:
@@ -93,119 +251,163 @@ class TerraService:
     
     def _process_activity_webhook(self, webhook_data: Dict) -> Dict:
         """Process Terra activity webhook"""
+        db = None
         try:
-            user_data = webhook_data.get('user', {})
+            user_data = webhook_data.get('user') or {}
             terra_user_id = user_data.get('user_id')
-            data = webhook_data.get('data', [])
+            data = webhook_data.get('data') or []
             
-            if not terra_user_id or not data:
-                logger.error("Missing user_id or data in activity webhook")
+            if not terra_user_id:
+                logger.error("Missing user_id in activity webhook")
                 return {'status': 'error', 'reason': 'Missing required fields'}
             
+            # Process activity data
+            records = []
+            for activity_data in data:
+                # A malformed record is skipped on its own so the user's other records are still stored
+                try:
+                    activity_date = activity_data.get('calendar_date')
+                    if not activity_date:
+                        continue
+                    
+                    # Parse activity metrics; sections may be missing or null
+                    records.append({
+                        'date': date.fromisoformat(activity_date),
+                        'active_calories': (activity_data.get('active_durations_data') or {}).get('active_calories'),
+                        'steps': (activity_data.get('distance_data') or {}).get('steps')
+                    })
+                except (AttributeError, TypeError, ValueError) as e:
+                    logger.error(f"Skipping invalid activity record for Terra user {terra_user_id}: {str(e)}")
+            
+            # Nothing to store: answer without checking out a DB connection
+            if not records:
+                logger.debug("No dated records in activity webhook")
+                return {'status': 'noop', 'processed_count': 0}
+            
             # Find user by Terra user ID
             db = next(get_db())
-            user_profile = db.query(UserProfile).filter(UserProfile.terra_user_id == terra_user_id).first()
+            user_id = self._get_user_id_by_terra_id(db, terra_user_id)
             
-            if not user_profile:
+            if not user_id:
                 logger.error(f"User profile not found for Terra user ID: {terra_user_id}")
                 return {'status': 'error', 'reason': 'User profile not found'}
             
-            # Process activity data
-            processed_count = 0
-            for activity_data in data:
-                activity_date = activity_data.get('calendar_date')
-                if not activity_date:
-                    continue
-                
-                # Parse activity metrics
-                active_calories = activity_data.get('active_durations_data', {}).get('active_calories')
-                steps = activity_data.get('distance_data', {}).get('steps')
-                
-                # Create or update activity log
-                activity_log = db.query(ActivityLog).filter(
-                    ActivityLog.user_id == user_profile.user_id,
-                    ActivityLog.date == date.fromisoformat(activity_date)
-                ).first()
-                
-                if not activity_log:
-                    activity_log = ActivityLog(
-                        user_id=user_profile.user_id,
-                        date=date.fromisoformat(activity_date)
-                    )
-                    db.add(activity_log)
-                
-                # Update activity data
-                if active_calories is not None:
-                    activity_log.active_calories = active_calories
-                if steps is not None:
-                    activity_log.steps = steps
-                
-                processed_count += 1
-            
+            # Create or update activity logs in one statement
+            processed_count = len(records)
+            self._upsert_activity_logs(db, user_id, records, ('active_calories', 'steps'))
             db.commit()
-            logger.info(f"Processed {processed_count} activity records for user {user_profile.user_id}")
+            logger.info(f"Processed {processed_count} activity records for user {user_id}")
             return {'status': 'success', 'processed_count': processed_count}
             
         except Exception as e:
             logger.error(f"Error processing activity webhook: {str(e)}")
+            if db:
+                db.rollback()
             raise
+        finally:
+            if db:
+                db.close()
     
     def _process_sleep_webhook(self, webhook_data: Dict) -> Dict:
         """Process Terra sleep webhook"""
+        db = None
         try:
-            user_data = webhook_data.get('user', {})
+            user_data = webhook_data.get('user') or {}
             terra_user_id = user_data.get('user_id')
-            data = webhook_data.get('data', [])
+            data = webhook_data.get('data') or []
             
-            if not terra_user_id or not data:
-                logger.error("Missing user_id or data in sleep webhook")
+            if not terra_user_id:
+                logger.error("Missing user_id in sleep webhook")
                 return {'status': 'error', 'reason': 'Missing required fields'}
             
+            # Process sleep data
+            records = []
+            for sleep_data in data:
+                # A malformed record is skipped on its own so the user's other records are still stored
+                try:
+                    sleep_date = sleep_data.get('calendar_date')
+                    if not sleep_date:
+                        continue
+                    
+                    # Parse sleep duration (in seconds, convert to whole minutes); sections may be missing or null
+                    sleep_durations = sleep_data.get('sleep_durations_data') or {}
+                    asleep = sleep_durations.get('asleep') or {}
+                    sleep_duration_seconds = asleep.get('duration_asleep_state_seconds')
+                    sleep_duration_min = int(sleep_duration_seconds) // 60 if sleep_duration_seconds else None
+                    
+                    records.append({'date': date.fromisoformat(sleep_date), 'sleep_duration_min': sleep_duration_min})
+                except (AttributeError, TypeError, ValueError) as e:
+                    logger.error(f"Skipping invalid sleep record for Terra user {terra_user_id}: {str(e)}")
+            
+            # Nothing to store: answer without checking out a DB connection
+            if not records:
+                logger.debug("No dated records in sleep webhook")
+                return {'status': 'noop', 'processed_count': 0}
+            
             # Find user by Terra user ID
             db = next(get_db())
-            user_profile = db.query(UserProfile).filter(UserProfile.terra_user_id == terra_user_id).first()
+            user_id = self._get_user_id_by_terra_id(db, terra_user_id)
             
-            if not user_profile:
+            if not user_id:
                 logger.error(f"User profile not found for Terra user ID: {terra_user_id}")
                 return {'status': 'error', 'reason': 'User profile not found'}
             
-            # Process sleep data
-            processed_count = 0
-            for sleep_data in data:
-                sleep_date = sleep_data.get('calendar_date')
-                if not sleep_date:
-                    continue
-                
-                # Parse sleep duration (in seconds, convert to minutes)
-                sleep_duration_seconds = sleep_data.get('sleep_durations_data', {}).get('asleep', {}).get('duration_asleep_state_seconds')
-                sleep_duration_min = sleep_duration_seconds // 60 if sleep_duration_seconds else None
-                
-                # Create or update activity log
-                activity_log = db.query(ActivityLog).filter(
-                    ActivityLog.user_id == user_profile.user_id,
-                    ActivityLog.date == date.fromisoformat(sleep_date)
-                ).first()
-                
-                if not activity_log:
-                    activity_log = ActivityLog(
-                        user_id=user_profile.user_id,
-                        date=date.fromisoformat(sleep_date)
-                    )
-                    db.add(activity_log)
-                
-                # Update sleep data
-                if sleep_duration_min is not None:
-                    activity_log.sleep_duration_min = sleep_duration_min
-                
-                processed_count += 1
-            
+            # Create or update activity logs in one statement
+            processed_count = len(records)
+            self._upsert_activity_logs(db, user_id, records, ('sleep_duration_min',))
             db.commit()
-            logger.info(f"Processed {processed_count} sleep records for user {user_profile.user_id}")
+            logger.info(f"Processed {processed_count} sleep records for user {user_id}")
             return {'status': 'success', 'processed_count': processed_count}
             
         except Exception as e:
             logger.error(f"Error processing sleep webhook: {str(e)}")
+            if db:
+                db.rollback()
             raise
+        finally:
+            if db:
+                db.close()
+    
+    def _get_user_id_by_terra_id(self, db, terra_user_id: str) -> Optional[int]:
+        """Resolve our user ID for a Terra user ID, caching found mappings"""
+        now = monotonic()
+        cached = _terra_user_cache.get(terra_user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        
+        user_id = db.query(UserProfile.user_id).filter(UserProfile.terra_user_id == terra_user_id).limit(1).scalar()
+        if user_id:
+            with _terra_user_cache_lock:
+                if len(_terra_user_cache) >= _TERRA_USER_CACHE_MAX_ENTRIES:
+                    _terra_user_cache.clear()
+                _terra_user_cache[terra_user_id] = (user_id, now + TERRA_USER_CACHE_TTL)
+        return user_id
+    
+    def _upsert_activity_logs(self, db, user_id: int, records: List[Dict], fields: tuple) -> None:
+        """
+        Insert or update one activity log per date with a single INSERT ... ON CONFLICT.
+
+        A None value never overwrites what is already stored, and records repeating
+        a date are merged in order, matching a sequence of per-record updates.
+        """
+        rows_by_date = {}
+        for record in records:
+            row = rows_by_date.get(record['date'])
+            if row is None:
+                row = rows_by_date[record['date']] = {'user_id': user_id, 'date': record['date'], **dict.fromkeys(fields)}
+            for field in fields:
+                if record.get(field) is not None:
+                    row[field] = record[field]
+        
+        if not rows_by_date:
+            return
+        
+        stmt = pg_insert(ActivityLog).values(list(rows_by_date.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'date'],
+            set_={field: func.coalesce(stmt.excluded[field], ActivityLog.__table__.c[field]) for field in fields}
+        )
+        db.execute(stmt)
     
     def get_user_data(self, terra_user_id: str, data_type: str = 'activity') -> Optional[Dict]:
         """Get user data from Terra API"""
@@ -217,7 +419,7 @@ class TerraService:
                 'end_date': date.today().isoformat()
             }
             
-            response = requests.get(endpoint, headers=self.headers, params=params)
+            response = self.http.get(endpoint, headers=self.headers, params=params, timeout=TERRA_REQUEST_TIMEOUT)
             response.raise_for_status()
             
             return response.json()
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import logging
 from config.settings import Config
@@ -8,6 +8,11 @@ from routes.terra_routes import terra_bp
 from routes.health_routes import health_bp
 from services.scheduler_service import scheduler
 
+# Error bodies are constant, so serialize them once. A fresh Response is still built per
+# request because after_request hooks (e.g. CORS) add headers to the response object.
+_NOT_FOUND_BODY = b'{"error": "Not found"}'
+_INTERNAL_ERROR_BODY = b'{"error": "Internal server error"}'
+
 def create_app():
     """Create and configure Flask application"""
     app = Flask(__name__)
@@ -48,11 +53,11 @@ def create_app():
     
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify({'error': 'Not found'}), 404
+        return Response(_NOT_FOUND_BODY, status=404, mimetype='application/json')
     
     @app.errorhandler(500)
     def internal_error(error):
-        return jsonify({'error': 'Internal server error'}), 500
+        return Response(_INTERNAL_ERROR_BODY, status=500, mimetype='application/json')
     
     return app
 
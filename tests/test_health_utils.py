@@ -75,6 +75,21 @@ class TestHealthCalculator(BaseTestCase):
         
         self.assertAlmostEqual(min_weight, round(expected_min, 1))
         self.assertAlmostEqual(max_weight, round(expected_max, 1))
+    
+    def test_analyze_nutrition_balance(self):
+        """Test nutrition balance analysis"""
+        consumed = {'calories': 2400, 'protein_g': 60, 'fat_g': 50}
+        targets = {'calories': 2000, 'protein_g': 120, 'fat_g': 50, 'carbs_g': 0}
+        
+        analysis = HealthCalculator.analyze_nutrition_balance(consumed, targets)
+        
+        self.assertEqual(analysis['calories']['percentage'], 120.0)
+        self.assertEqual(analysis['calories']['remaining'], 0)
+        self.assertEqual(analysis['calories']['status'], 'over')
+        self.assertEqual(analysis['protein_g']['remaining'], 60)
+        self.assertEqual(analysis['protein_g']['status'], 'under')
+        self.assertEqual(analysis['fat_g']['status'], 'good')
+        self.assertEqual(analysis['carbs_g']['status'], 'no_target')
 
 class TestMealPlanner(BaseTestCase):
     """Test cases for MealPlanner utility"""
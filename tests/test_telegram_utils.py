@@ -0,0 +1,109 @@
+import unittest
+from tests.test_config import BaseTestCase
+from utils.telegram_utils import Entity, parse_markdown_to_entities, clean_keyboard_text, clean_keyboard_markup
+
+class TestParseMarkdownToEntities(BaseTestCase):
+    """Test cases for parse_markdown_to_entities"""
+
+    def test_empty_text(self):
+        """Test empty text returns no entities"""
+        self.assertEqual(parse_markdown_to_entities(""), ("", []))
+
+    def test_plain_text(self):
+        """Test text without markdown is returned unchanged"""
+        plain_text, entities = parse_markdown_to_entities("Дневная сводка за сегодня")
+
+        self.assertEqual(plain_text, "Дневная сводка за сегодня")
+        self.assertEqual(entities, [])
+
+    def test_formatting_entities(self):
+        """Test bold, italic and strikethrough entities"""
+        plain_text, entities = parse_markdown_to_entities("*Цели* и _вес_ без ~ошибок~")
+
+        self.assertEqual(plain_text, "Цели и вес без ошибок")
+        self.assertEqual(entities, [
+            Entity('bold', 0, 4),
+            Entity('italic', 7, 3),
+            Entity('strikethrough', 15, 6)
+        ])
+
+    def test_utf16_offsets(self):
+        """Test offsets count emoji outside the BMP as two UTF-16 code units"""
+        plain_text, entities = parse_markdown_to_entities("📊 *Белки:* 120г")
+
+        self.assertEqual(plain_text, "📊 Белки: 120г")
+        self.assertEqual(entities, [Entity('bold', 3, 6)])
+
+    def test_overlapping_markers(self):
+        """Test overlapping markers resolve to the leftmost entity"""
+        plain_text, entities = parse_markdown_to_entities("*a_b*c_ d")
+
+        self.assertEqual(plain_text, "a_bc_ d")
+        self.assertEqual(entities, [Entity('bold', 0, 3)])
+
+    def test_unclosed_marker(self):
+        """Test a lone marker is kept as text"""
+        plain_text, entities = parse_markdown_to_entities("5 * 3 = 15")
+
+        self.assertEqual(plain_text, "5 * 3 = 15")
+        self.assertEqual(entities, [])
+
+    def test_empty_markers(self):
+        """Test empty marker pairs are kept as text, not empty entities"""
+        plain_text, entities = parse_markdown_to_entities("__ и *да*")
+
+        self.assertEqual(plain_text, "__ и да")
+        self.assertEqual(entities, [Entity('bold', 5, 2)])
+
+    def test_double_star_bold(self):
+        """Test **bold** is a bold entity without visible markers"""
+        plain_text, entities = parse_markdown_to_entities("• **Garmin** - часы и *трекеры*")
+
+        self.assertEqual(plain_text, "• Garmin - часы и трекеры")
+        self.assertEqual(entities, [Entity('bold', 2, 6), Entity('bold', 18, 7)])
+
+    def test_marker_across_lines(self):
+        """Test entities do not span line breaks"""
+        plain_text, entities = parse_markdown_to_entities("*a\nb* _c_")
+
+        self.assertEqual(plain_text, "*a\nb* c")
+        self.assertEqual(entities, [Entity('italic', 6, 1)])
+
+    def test_entity_as_dict(self):
+        """Test entities convert to the Bot API dict shape"""
+        _, entities = parse_markdown_to_entities("*Вес*")
+
+        self.assertEqual(entities[0]._asdict(), {'type': 'bold', 'offset': 0, 'length': 3})
+
+class TestKeyboardCleaning(BaseTestCase):
+    """Test cases for keyboard text cleaning"""
+
+    def test_clean_keyboard_text(self):
+        """Test markdown symbols are removed from button text"""
+        self.assertEqual(clean_keyboard_text("*Вес* (г) [_new_] ~x~ `y`"), "Вес г new x y")
+        self.assertEqual(clean_keyboard_text(""), "")
+
+    def test_clean_keyboard_markup(self):
+        """Test button texts are cleaned and other fields kept"""
+        keyboard = [
+            [{'text': '*Калории*', 'callback_data': 'food:edit_field:1:calories'}],
+            [{'text': '🔙 Назад', 'callback_data': 'back_to_main'}, 'raw']
+        ]
+
+        cleaned = clean_keyboard_markup(keyboard)
+
+        self.assertEqual(cleaned, [
+            [{'text': 'Калории', 'callback_data': 'food:edit_field:1:calories'}],
+            [{'text': '🔙 Назад', 'callback_data': 'back_to_main'}, 'raw']
+        ])
+        # The input keyboard is not modified
+        self.assertEqual(keyboard[0][0]['text'], '*Калории*')
+
+    def test_clean_keyboard_markup_unchanged(self):
+        """Test a keyboard without markdown is returned without copying"""
+        keyboard = [[{'text': '📊 Дневная сводка', 'callback_data': 'summary'}]]
+
+        self.assertIs(clean_keyboard_markup(keyboard), keyboard)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import unittest
+from datetime import date
+from unittest.mock import Mock, patch
+from tests.test_config import BaseTestCase, TestConfig
+
+# database.connection requires DATABASE_URL at import time; the engine never connects in these tests
+os.environ.setdefault('DATABASE_URL', TestConfig.DATABASE_URL)
+
+from services.terra_service import TerraService
+
+def activity_webhook(*calendar_dates, steps=1000):
+    """Build an activity webhook for one Terra user"""
+    return {
+        'type': 'activity',
+        'user': {'user_id': 'terra-1'},
+        'data': [{'calendar_date': d, 'distance_data': {'steps': steps}} for d in calendar_dates]
+    }
+
+class TestTerraWebhookBatch(BaseTestCase):
+    """Test cases for batched Terra webhook processing"""
+
+    def setUp(self):
+        super().setUp()
+        self.terra_service = TerraService()
+        patchers = [
+            patch('services.terra_service.get_db', side_effect=lambda: iter([Mock()])),
+            patch.object(TerraService, '_get_user_id_by_terra_id', return_value=42),
+            patch.object(TerraService, '_upsert_activity_logs')
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def upserted_dates(self):
+        """Dates passed to each upsert call"""
+        return [[record['date'] for record in call.args[2]] for call in TerraService._upsert_activity_logs.call_args_list]
+
+    def test_bad_record_keeps_other_records(self):
+        """Test a malformed record does not drop the user's valid records from other webhooks"""
+        with self.assertLogs('services.terra_service', level='ERROR'):
+            result = self.terra_service.process_webhook([
+                activity_webhook('2024-05-01'),
+                activity_webhook('2024-5-2')
+            ])
+
+        self.assertEqual(self.upserted_dates(), [[date(2024, 5, 1)]])
+        self.assertEqual(result['results'][0]['status'], 'success')
+
+    def test_null_record_is_skipped(self):
+        """Test a null item in data is skipped"""
+        webhook = activity_webhook('2024-05-01')
+        webhook['data'].append(None)
+
+        with self.assertLogs('services.terra_service', level='ERROR'):
+            self.terra_service.process_webhook([webhook])
+
+        self.assertEqual(self.upserted_dates(), [[date(2024, 5, 1)]])
+
+    def test_failed_merged_payload_is_retried_per_webhook(self):
+        """Test webhooks of a failed merged payload are retried one by one"""
+        TerraService._upsert_activity_logs.side_effect = [Exception('numeric field overflow'), None, Exception('numeric field overflow')]
+
+        with self.assertLogs('services.terra_service', level='ERROR'):
+            result = self.terra_service.process_webhook([
+                activity_webhook('2024-05-01'),
+                activity_webhook('2024-05-02', steps=10 ** 12)
+            ])
+
+        self.assertEqual(self.upserted_dates(), [
+            [date(2024, 5, 1), date(2024, 5, 2)],
+            [date(2024, 5, 1)],
+            [date(2024, 5, 2)]
+        ])
+        self.assertEqual([item['status'] for item in result['results']], ['success', 'error'])
+
+if __name__ == '__main__':
+    unittest.main()
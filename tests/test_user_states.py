@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from tests.test_config import BaseTestCase
+from utils.user_states import UserStateManager, SQLiteStateManager, States
+
+class TestUserStateManager(BaseTestCase):
+    """Test cases for the in-memory state manager (also run against SQLite below)"""
+
+    def setUp(self):
+        super().setUp()
+        self.manager = self.create_manager()
+
+    def create_manager(self, ttl_seconds=3600):
+        return UserStateManager(ttl_seconds=ttl_seconds)
+
+    def test_set_and_get_state(self):
+        """Test state and data are returned as set"""
+        self.manager.set_state(1, States.FOOD_EDIT_WEIGHT, {'log_id': 5, 'name': 'Гречка'})
+
+        state = self.manager.get_state(1)
+        self.assertEqual(state['state'], States.FOOD_EDIT_WEIGHT)
+        self.assertEqual(state['data'], {'log_id': 5, 'name': 'Гречка'})
+        self.assertEqual(self.manager.get_state_name(1), States.FOOD_EDIT_WEIGHT)
+        self.assertEqual(self.manager.get_state_data(1), {'log_id': 5, 'name': 'Гречка'})
+
+    def test_update_state_data(self):
+        """Test updates are merged into existing data"""
+        self.manager.set_state(1, States.GOAL_CHANGE_TARGET_WEIGHT, {'current_weight': 80})
+        self.manager.update_state_data(1, {'target_weight': 75})
+
+        self.assertEqual(self.manager.get_state_data(1), {'current_weight': 80, 'target_weight': 75})
+        self.assertEqual(self.manager.get_state_name(1), States.GOAL_CHANGE_TARGET_WEIGHT)
+
+    def test_update_state_data_without_state(self):
+        """Test updating a user without state does not create one"""
+        self.manager.update_state_data(1, {'target_weight': 75})
+
+        self.assertIsNone(self.manager.get_state(1))
+
+    def test_clear_state(self):
+        """Test cleared state is gone and clearing twice is harmless"""
+        self.manager.set_state(1, States.REPORT_TIME_INPUT)
+        self.manager.clear_state(1)
+        self.manager.clear_state(1)
+
+        self.assertIsNone(self.manager.get_state(1))
+        self.assertIsNone(self.manager.get_state_name(1))
+
+    def test_empty_state_data_is_read_only(self):
+        """Test users without data get a shared read-only empty mapping"""
+        data = self.manager.get_state_data(1)
+
+        self.assertEqual(dict(data), {})
+        with self.assertRaises(TypeError):
+            data['log_id'] = 5
+        self.assertIs(self.manager.get_state_data(2), data)
+
+    def test_ttl_expiry(self):
+        """Test states older than the TTL are dropped on read"""
+        manager = self.create_manager(ttl_seconds=60)
+        manager.set_state(1, States.REPORT_TIME_INPUT, {'step': 1})
+
+        with patch('utils.user_states.time.time', return_value=time.time() + 61):
+            self.assertIsNone(manager.get_state(1))
+        self.assertIsNone(manager.get_state(1))
+
+class TestUserStateManagerLimits(BaseTestCase):
+    """Test cases for the in-memory state manager size limit"""
+
+    def test_lru_cap(self):
+        """Test the least recently written dialog is evicted beyond max_entries"""
+        manager = UserStateManager(max_entries=2)
+        manager.set_state(1, States.FOOD_EDIT_SELECT)
+        manager.set_state(2, States.FOOD_EDIT_SELECT)
+        manager.update_state_data(1, {'log_id': 5})
+        manager.set_state(3, States.FOOD_EDIT_SELECT)
+
+        self.assertIsNotNone(manager.get_state(1))
+        self.assertIsNone(manager.get_state(2))
+        self.assertIsNotNone(manager.get_state(3))
+
+class TestSQLiteStateManager(TestUserStateManager):
+    """Test cases for the SQLite-backed state manager"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        super().setUp()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        super().tearDown()
+
+    def create_manager(self, ttl_seconds=3600):
+        return SQLiteStateManager(os.path.join(self.tmp_dir.name, 'states.db'), ttl_seconds=ttl_seconds)
+
+    def test_state_shared_between_instances(self):
+        """Test state written by one manager is visible to another on the same file"""
+        self.manager.set_state(1, States.FOOD_EDIT_CALORIES, {'log_id': 5})
+
+        self.assertEqual(self.create_manager().get_state_data(1), {'log_id': 5})
+
+    def test_database_created_on_first_use(self):
+        """Test constructing the manager does not create the database file"""
+        db_path = os.path.join(self.tmp_dir.name, 'lazy.db')
+        manager = SQLiteStateManager(db_path)
+        self.assertFalse(os.path.exists(db_path))
+
+        manager.set_state(1, States.REPORT_TIME_INPUT)
+        self.assertTrue(os.path.exists(db_path))
+
+if __name__ == '__main__':
+    unittest.main()
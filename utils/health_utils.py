@@ -1,7 +1,28 @@
 import math
+from types import MappingProxyType
 from typing import Dict, List, Tuple
 from datetime import date, datetime, timedelta
 
+# TDEE multiplier per activity level (read-only, shared by all callers)
+ACTIVITY_MULTIPLIERS = MappingProxyType({
+    'sedentary': 1.2,    # Little to no exercise
+    'moderate': 1.55,    # Light exercise 1-3 days/week
+    'active': 1.725      # Moderate exercise 3-5 days/week
+})
+
+# Macronutrient split: protein per kg of body weight, share of calories from fat
+_PROTEIN_G_PER_KG = 1.8
+_FAT_CALORIE_SHARE = 0.25
+_FAT_G_PER_CAL = _FAT_CALORIE_SHARE / 9  # 9 calories per gram of fat
+
+# Share of daily calories per meal
+_MEAL_RATIOS = (('breakfast', 0.25), ('lunch', 0.35), ('dinner', 0.30), ('snacks', 0.10))
+
+# Nutrients compared by analyze_nutrition_balance
+_BALANCE_NUTRIENTS = ('calories', 'protein_g', 'fat_g', 'carbs_g')
+# Percent-of-target band considered on track
+_BALANCE_LOW_PCT, _BALANCE_HIGH_PCT = 90, 110
+
 class HealthCalculator:
     """Utility class for health-related calculations"""
     
@@ -38,13 +59,7 @@ class HealthCalculator:
         Returns:
             TDEE in calories per day
         """
-        activity_multipliers = {
-            'sedentary': 1.2,    # Little to no exercise
-            'moderate': 1.55,    # Light exercise 1-3 days/week
-            'active': 1.725      # Moderate exercise 3-5 days/week
-        }
-        
-        multiplier = activity_multipliers.get(activity_level.lower(), 1.2)
+        multiplier = ACTIVITY_MULTIPLIERS.get(activity_level.lower(), 1.2)
         return round(bmr * multiplier, 2)
     
     @staticmethod
@@ -79,11 +94,11 @@ class HealthCalculator:
             Dictionary with protein, fat, and carb targets in grams
         """
         # Protein: 1.6-2.2g per kg body weight (use 1.8g)
-        protein_g = round(weight_kg * 1.8, 2)
+        protein_g = round(weight_kg * _PROTEIN_G_PER_KG, 2)
         
         # Fat: 20-35% of calories (use 25%)
-        fat_calories = daily_calories * 0.25
-        fat_g = round(fat_calories / 9, 2)  # 9 calories per gram of fat
+        fat_calories = daily_calories * _FAT_CALORIE_SHARE
+        fat_g = round(daily_calories * _FAT_G_PER_CAL, 2)
         
         # Carbs: remaining calories
         protein_calories = protein_g * 4  # 4 calories per gram of protein
@@ -207,21 +222,23 @@ class HealthCalculator:
             Analysis with percentages and recommendations
         """
         analysis = {}
+        consumed_get = consumed.get
+        targets_get = targets.get
         
-        for nutrient in ['calories', 'protein_g', 'fat_g', 'carbs_g']:
-            consumed_amount = consumed.get(nutrient, 0)
-            target_amount = targets.get(nutrient, 0)
+        for nutrient in _BALANCE_NUTRIENTS:
+            consumed_amount = consumed_get(nutrient, 0)
+            target_amount = targets_get(nutrient, 0)
             
             if target_amount > 0:
-                percentage = (consumed_amount / target_amount) * 100
+                percentage = consumed_amount * 100 / target_amount
                 remaining = target_amount - consumed_amount
                 
                 analysis[nutrient] = {
                     'consumed': consumed_amount,
                     'target': target_amount,
                     'percentage': round(percentage, 1),
-                    'remaining': max(0, remaining),
-                    'status': 'over' if percentage > 110 else 'under' if percentage < 90 else 'good'
+                    'remaining': remaining if remaining > 0 else 0,
+                    'status': 'over' if percentage > _BALANCE_HIGH_PCT else 'under' if percentage < _BALANCE_LOW_PCT else 'good'
                 }
             else:
                 analysis[nutrient] = {
@@ -248,12 +265,7 @@ class MealPlanner:
         Returns:
             Dictionary with suggested calories per meal
         """
-        return {
-            'breakfast': int(daily_calories * 0.25),  # 25%
-            'lunch': int(daily_calories * 0.35),     # 35%
-            'dinner': int(daily_calories * 0.30),    # 30%
-            'snacks': int(daily_calories * 0.10)     # 10%
-        }
+        return {meal: int(daily_calories * ratio) for meal, ratio in _MEAL_RATIOS}
     
     @staticmethod
     def calculate_remaining_calories(daily_target: int, consumed_today: int) -> Dict:
@@ -0,0 +1,8 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+def create_http_session() -> requests.Session:
+    """Create HTTP session with a keep-alive connection pool for external API calls"""
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=10, pool_maxsize=50))
+    return session
@@ -1,7 +1,41 @@
 import re
-from typing import Tuple, List, Dict, Union
+from functools import lru_cache
+from typing import Tuple, List, Dict, Union, NamedTuple
 
-def parse_markdown_to_entities(text: str) -> Tuple[str, List[Dict]]:
+# Single-pass tokenizer: every match is either an entity (group name is the entity type)
+# or a run of plain text; a marker that opens no entity is a one-character text token.
+# Entity bodies are negated classes: an unclosed marker fails at the first newline or
+# marker instead of backtracking, and empty pairs like ** are not entities.
+# **bold** (common in our own texts and OpenAI replies) is tried before *bold*.
+_MD_TOKEN_RE = re.compile(
+    r'\*\*(?P<double_bold>[^*\n]+)\*\*|\*(?P<bold>[^*\n]+)\*|_(?P<italic>[^_\n]+)_|~(?P<strikethrough>[^~\n]+)~'
+    r'|(?P<text>[^*_~]+|[*_~])'
+)
+
+# Token groups whose name is not the entity type itself
+_MD_ENTITY_TYPES = {'double_bold': 'bold'}
+
+# Markers that can start an entity; text without any of them needs no parsing
+_MD_CHARS = frozenset('*_~')
+
+# Markdown symbols stripped from keyboard button text
+_MD_STRIP_CHARS = frozenset('*_~`[]()')
+_MD_STRIP_TABLE = str.maketrans('', '', '*_~`[]()')
+
+class Entity(NamedTuple):
+    """Telegram message entity; offset and length are in UTF-16 code units"""
+    type: str
+    offset: int
+    length: int
+
+def _utf16_len(text: str) -> int:
+    """Length of text in UTF-16 code units, the unit Telegram uses for entity offsets"""
+    # ASCII characters are one code unit each; only non-ASCII text needs encoding
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-16-le')) // 2
+
+def parse_markdown_to_entities(text: str) -> Tuple[str, List[Entity]]:
     """
     Parse simple Markdown text to Telegram Message Entities.
     
@@ -14,74 +48,51 @@ def parse_markdown_to_entities(text: str) -> Tuple[str, List[Dict]]:
         text: Text with Markdown formatting
         
     Returns:
-        Tuple of (plain_text, entities_list)
+        Tuple of (plain_text, entities_list); use Entity._asdict() for the Bot API payload
     """
     if not text:
         return "", []
     
-    entities = []
-    
-    # Define all formatting patterns
-    patterns = [
-        (r'\*(.*?)\*', 'bold'),
-        (r'_(.*?)_', 'italic'),
-        (r'~(.*?)~', 'strikethrough')
-    ]
-    
-    # Find all matches with their positions
-    all_matches = []
-    for pattern, entity_type in patterns:
-        for match in re.finditer(pattern, text):
-            all_matches.append({
-                'start': match.start(),
-                'end': match.end(),
-                'content': match.group(1),
-                'type': entity_type
-            })
+    # Most messages carry no markdown at all
+    if _MD_CHARS.isdisjoint(text):
+        return text, []
     
-    # Sort matches by start position
-    all_matches.sort(key=lambda x: x['start'])
-    
-    # Build plain text and calculate offsets using UTF-16 positions
-    plain_text = ""
-    current_pos = 0
+    plain_text, entities = _parse_markdown_cached(text)
+    return plain_text, list(entities)
+
+@lru_cache(maxsize=1024)
+def _parse_markdown_cached(text: str) -> Tuple[str, Tuple[Entity, ...]]:
+    """Parse markdown text; cached because menus and canned replies repeat the same strings"""
+    entities = []
     
-    for match in all_matches:
-        # Add text before this match
-        plain_text += text[current_pos:match['start']]
-        
-        # Calculate offset in plain text using UTF-16 length
-        # Convert to UTF-16 and count code units (divide by 2 for UTF-16LE)
-        offset = len(plain_text.encode('utf-16-le')) // 2
-        
-        # Calculate length of content in UTF-16
-        content_length = len(match['content'].encode('utf-16-le')) // 2
-        
-        # Create entity
-        entity = {
-            'type': match['type'],
-            'offset': offset,
-            'length': content_length
-        }
-        entities.append(entity)
-        
-        # Add the content to plain text
-        plain_text += match['content']
+    # Build plain text and calculate offsets using UTF-16 positions.
+    # Tokens cover the text left to right; overlapping markers resolve to the leftmost.
+    parts = []
+    utf16_offset = 0  # UTF-16 length of the plain text built so far
+    
+    for token in _MD_TOKEN_RE.finditer(text):
+        kind = token.lastgroup
+        if kind == 'text':
+            chunk = token.group()
+            parts.append(chunk)
+            utf16_offset += _utf16_len(chunk)
+            continue
         
-        # Move position past this match
-        current_pos = match['end']
-    
-    # Add remaining text
-    plain_text += text[current_pos:]
-    
-    # Sort entities by offset for consistency
-    entities.sort(key=lambda x: x['offset'])
-    
-    return plain_text, entities
+        # Entity: its content goes to plain text, markers are dropped
+        content = token.group(kind)
+        content_length = _utf16_len(content)
+        entities.append(Entity(_MD_ENTITY_TYPES.get(kind, kind), utf16_offset, content_length))
+        parts.append(content)
+        utf16_offset += content_length
+    
+    # No sort needed: finditer yields tokens left to right, so entities are already by offset
+    return ''.join(parts), tuple(entities)
 
+@lru_cache(maxsize=2048)
 def clean_keyboard_text(text: str) -> str:
     """
     Clean text for keyboard buttons by removing all markdown formatting.
+    Results are cached, so text must be a str (button labels are mostly constants).
     
     Args:
         text: Text that may contain markdown formatting
@@ -92,8 +103,11 @@ def clean_keyboard_text(text: str) -> str:
     if not text:
         return ""
     
+    if _MD_STRIP_CHARS.isdisjoint(text):
+        return text
+    
     # Remove all markdown formatting symbols
-    cleaned = re.sub(r'[\*_~`\[\]\(\)]', '', text)
+    cleaned = text.translate(_MD_STRIP_TABLE)
     return cleaned
 
 def clean_keyboard_markup(keyboard: List[List[Dict]]) -> List[List[Dict]]:
@@ -104,28 +118,26 @@ def clean_keyboard_markup(keyboard: List[List[Dict]]) -> List[List[Dict]]:
         keyboard: Keyboard markup structure
         
     Returns:
-        Cleaned keyboard markup
+        Cleaned keyboard markup (the input keyboard itself if nothing needed cleaning)
     """
     if not keyboard:
         return keyboard
     
     cleaned_keyboard = []
+    changed = False
     
     for row in keyboard:
         cleaned_row = []
         for button in row:
-            if isinstance(button, dict):
-                cleaned_button = button.copy()
-                # Clean text field
-                if 'text' in cleaned_button:
-                    cleaned_button['text'] = clean_keyboard_text(cleaned_button['text'])
-                cleaned_row.append(cleaned_button)
-            elif isinstance(button, str):
-                # Если вдруг встретили строку — просто добавляем как есть
-                cleaned_row.append(button)
+            text = button.get('text') if isinstance(button, dict) else None
+            cleaned_text = clean_keyboard_text(text) if text else text
+            if cleaned_text != text:
+                # Copy the button only when its text actually changes
+                cleaned_row.append({**button, 'text': cleaned_text})
+                changed = True
             else:
-                # На всякий случай, если тип неизвестен
+                # Строки, кнопки неизвестного типа и без разметки добавляем как есть
                 cleaned_row.append(button)
         cleaned_keyboard.append(cleaned_row)
     
-    return cleaned_keyboard 
\ No newline at end of file
+    return cleaned_keyboard if changed else keyboard 
\ No newline at end of file
@@ -1,57 +1,226 @@
 """
 User state management for multi-step dialogs
 """
+import os
 import logging
-from typing import Dict, Optional
-from datetime import datetime
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
 import json
 
 logger = logging.getLogger(__name__)
 
+# Relative STATE_DB_PATH values are resolved against the project root, not the working directory
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Shared read-only result for users without dialog data
+_EMPTY_STATE_DATA = MappingProxyType({})
+
+class _Entry:
+    """Dialog state of one user; slotted to keep per-user memory small"""
+    __slots__ = ('state', 'data', 'timestamp')
+    
+    def __init__(self, state: str, data: Dict, timestamp: float):
+        self.state = state
+        self.data = data
+        self.timestamp = timestamp
+    
+    def as_dict(self) -> Dict:
+        """Entry as a dict, the shape returned by get_state"""
+        return {'state': self.state, 'data': self.data, 'timestamp': self.timestamp}
+
 class UserStateManager:
-    """Simple in-memory state manager for user dialogs"""
+    """
+    Simple in-memory state manager for user dialogs.
+
+    Entries older than ttl_seconds are treated as abandoned dialogs and dropped on read;
+    beyond max_entries the least recently written dialogs are evicted.
+
+    Writes are serialized by a lock; reads are lock-free (a single dict lookup is atomic
+    under the GIL), so a read racing a write sees either the old or the new entry.
+    """
+    __slots__ = ('user_states', 'max_entries', 'ttl_seconds', '_lock')
     
-    def __init__(self):
-        self.user_states = {}  # user_id -> state_data
+    def __init__(self, max_entries: int = 10000, ttl_seconds: int = 3600):
+        self.user_states = OrderedDict()  # user_id -> _Entry, least recently written first
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
     
     def set_state(self, user_id: int, state: str, data: Dict = None) -> None:
         """Set user state with optional data"""
-        self.user_states[user_id] = {
-            'state': state,
-            'data': data or {},
-            'timestamp': datetime.now().isoformat()
-        }
-        logger.info(f"State set for user {user_id}: {state}, data: {data}")
+        entry = _Entry(state, data or {}, time.time())
+        with self._lock:
+            self.user_states[user_id] = entry
+            self.user_states.move_to_end(user_id)
+            while len(self.user_states) > self.max_entries:
+                self.user_states.popitem(last=False)
+        logger.debug("State set for user %s: %s, data: %s", user_id, state, data)
+    
+    def _get_entry(self, user_id: int) -> Optional[_Entry]:
+        """Get user's entry, dropping it if the dialog has expired"""
+        entry = self.user_states.get(user_id)
+        if entry and time.time() - entry.timestamp > self.ttl_seconds:
+            with self._lock:
+                # Drop only the expired entry, not one written in the meantime
+                if self.user_states.get(user_id) is entry:
+                    del self.user_states[user_id]
+            return None
+        return entry
     
     def get_state(self, user_id: int) -> Optional[Dict]:
         """Get current user state"""
-        return self.user_states.get(user_id)
+        entry = self._get_entry(user_id)
+        return entry.as_dict() if entry else None
+    
+    def get_state_name(self, user_id: int) -> Optional[str]:
+        """Get current state name for user"""
+        entry = self._get_entry(user_id)
+        return entry.state if entry else None
+    
+    def get_state_data(self, user_id: int) -> Mapping:
+        """Get state data for user (a read-only empty mapping if there is none)"""
+        entry = self._get_entry(user_id)
+        result = entry.data if entry else _EMPTY_STATE_DATA
+        logger.debug("State data retrieved for user %s: %s", user_id, result)
+        return result
+    
+    def clear_state(self, user_id: int) -> None:
+        """Clear user state"""
+        with self._lock:
+            self.user_states.pop(user_id, None)
+    
+    def update_state_data(self, user_id: int, updates: Dict) -> None:
+        """Update state data for user"""
+        if not self._get_entry(user_id):
+            return
+        with self._lock:
+            entry = self.user_states.get(user_id)
+            if entry:
+                entry.data.update(updates)
+                entry.timestamp = time.time()
+                self.user_states.move_to_end(user_id)
+
+class SQLiteStateManager:
+    """
+    SQLite-backed state manager.
+
+    State survives restarts and is shared between worker processes on the same host.
+    Entries older than ttl_seconds are treated as abandoned dialogs and dropped on read.
+    The database file is created on first use, not when the manager is constructed.
+    """
+    __slots__ = ('db_path', 'ttl_seconds', '_local', '_schema_lock', '_schema_ready')
+    
+    def __init__(self, db_path: str, ttl_seconds: int = 3600):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()  # sqlite3 connections are per-thread
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+    
+    def _init_schema(self, conn: sqlite3.Connection) -> None:
+        """Create the table once per manager"""
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            # WAL mode is persistent in the database file, so it is set once rather than per connection
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS user_states (
+                    user_id INTEGER PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            self._schema_ready = True
+    
+    def _get_connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, opening it on first use (the threaded server may use many threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: autocommit, explicit BEGIN for read-modify-write
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            if not self._schema_ready:
+                self._init_schema(conn)
+        return conn
+    
+    def set_state(self, user_id: int, state: str, data: Dict = None) -> None:
+        """Set user state with optional data"""
+        self._get_connection().execute(
+            "INSERT OR REPLACE INTO user_states (user_id, state, data, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, state, json.dumps(data or {}, ensure_ascii=False), time.time())
+        )
+        logger.debug("State set for user %s: %s, data: %s", user_id, state, data)
+    
+    def get_state(self, user_id: int) -> Optional[Dict]:
+        """Get current user state"""
+        row = self._get_connection().execute(
+            "SELECT state, data, updated_at FROM user_states WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if not row:
+            return None
+        
+        state, data, updated_at = row
+        if time.time() - updated_at > self.ttl_seconds:
+            # Drop only the expired row, not a state written in the meantime by another worker
+            self._get_connection().execute(
+                "DELETE FROM user_states WHERE user_id = ? AND updated_at = ?", (user_id, updated_at)
+            )
+            return None
+        
+        return {'state': state, 'data': json.loads(data), 'timestamp': updated_at}
     
     def get_state_name(self, user_id: int) -> Optional[str]:
         """Get current state name for user"""
         state_data = self.get_state(user_id)
         return state_data.get('state') if state_data else None
     
-    def get_state_data(self, user_id: int) -> Dict:
-        """Get state data for user"""
+    def get_state_data(self, user_id: int) -> Mapping:
+        """Get state data for user (a read-only empty mapping if there is none)"""
         state_data = self.get_state(user_id)
-        result = state_data.get('data', {}) if state_data else {}
-        logger.info(f"State data retrieved for user {user_id}: {result}")
+        result = state_data['data'] if state_data else _EMPTY_STATE_DATA
+        logger.debug("State data retrieved for user %s: %s", user_id, result)
         return result
     
     def clear_state(self, user_id: int) -> None:
         """Clear user state"""
-        if user_id in self.user_states:
-            del self.user_states[user_id]
+        self._get_connection().execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
     
     def update_state_data(self, user_id: int, updates: Dict) -> None:
         """Update state data for user"""
-        if user_id in self.user_states:
-            self.user_states[user_id]['data'].update(updates)
-            self.user_states[user_id]['timestamp'] = datetime.now().isoformat()
+        conn = self._get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM user_states WHERE user_id = ?", (user_id,)).fetchone()
+            if row:
+                data = json.loads(row[0])
+                data.update(updates)
+                conn.execute(
+                    "UPDATE user_states SET data = ?, updated_at = ? WHERE user_id = ?",
+                    (json.dumps(data, ensure_ascii=False), time.time(), user_id)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+def create_state_manager():
+    """Create state manager for the backend selected by STATE_BACKEND ('sqlite' or 'memory')"""
+    backend = os.getenv('STATE_BACKEND', 'sqlite').lower()
+    ttl_seconds = int(os.getenv('STATE_TTL_SECONDS', '3600'))
+    if backend == 'memory':
+        return UserStateManager(ttl_seconds=ttl_seconds)
+    db_path = os.path.join(_PROJECT_ROOT, os.getenv('STATE_DB_PATH', 'user_states.db'))
+    return SQLiteStateManager(db_path, ttl_seconds=ttl_seconds)
 
 # Global state manager instance
-state_manager = UserStateManager()
+state_manager = create_state_manager()
 
 # State constants
 class States: